@@ -9,12 +9,12 @@ Skills acivity code for vehicle control lab guide.
 Students will implement a vehicle speed and steering controller.
 Please review Lab Guide - vehicle control PDF
 """
+# First, so start-up times are measured from here
+from startup import StartupLog, BackgroundLoad
 import os
 import signal
 import numpy as np
 from threading import Thread
-import time
-import torch
 import cv2
 import pyqtgraph as pg
 from pal.products.qcar import QCarRealSense
@@ -24,48 +24,177 @@ from pal.utilities.scope import MultiScope
 from pal.utilities.math import wrap_to_pi
 from hal.products.qcar import QCarEKF
 from hal.products.mats import SDCSRoadMap
+from controllers import SpeedController, SteeringController
+from clock import RealTimeClock
+from frame_gate import FrameGate
+from evidence import EvidenceAccumulator
+from lap_metrics import LapMetrics, split_indices
+from thread_budget import ThreadBudget
+from detour_paths import DetourLibrary
+from route_table import RouteHandOff
+from gps_ingest import GPSIngest
+from braking import BrakingPlanner
+from light_phase import LightPhaseAdvisor
+from frame_bus import BusCamera
+from light_colour import classify_light
+from scope_history import SignalHistory, save_histories
 import pal.resources.images as images
-from ultralytics import YOLO
-from ultralytics.utils.plotting import Annotator
-model = YOLO('yolov8s.pt' )
+# torch, ultralytics and the detector are loaded by load_perception, in the
+# background. cv2 and pyqtgraph are not: pal's camera and scope modules
+# import them anyway
 
 #================ Experiment Configuration ================
 # ===== Timing Parameters
 # - tf: experiment duration in seconds.
 # - startDelay: delay to give filters time to settle in seconds.
 # - controllerUpdateRate: control update rate in Hz. Shouldn't exceed 500
+# - clock: time source for controlLoop and the perception loop. Use
+#   clock.VirtualClock() to run faster than real time (see clock.py)
 tf = 3000
 # lap_time_elapsed = False
 startDelay = 1
 controllerUpdateRate = 500
+clock = RealTimeClock()
+
+# ===== Scope Parameters
+# - scopeWindow: seconds of full-detail data the time scopes keep. The whole
+#   run is kept in fixed-size decimated buffers instead and saved to
+#   scopeHistoryFile at exit; python scope_history.py plots it
+# - pathRefresh: seconds between redraws of the estimated path
+scopeWindow = 60
+scopeHistoryFile = 'scope_history.npz'
+pathRefresh = 1.0
 
 # ===== Speed Controller Parameters
 # - v_ref: desired velocity in m/s
 # - K_p: proportional gain for speed controller
 # - K_i: integral gain for speed controller
+# - useBrakingPlanner: brake for stop signs and red lights along a profile
+#   planned from speed and distance (braking.py) instead of stopping at a
+#   fixed box size. Calibrate its reference distance and deceleration on the
+#   car before raising v_ref
+# - redArea, stopArea: box area (percent of the frame) of a red light / stop
+#   sign at which to stop without the braking planner
+# - usePhaseAdvisor: learn the cycle of each light in trafficLights (positions
+#   as spawned by Traffic_Lights_Competition.py) and slow down ahead of time
+#   to arrive on green instead of stopping (light_phase.py)
 global v_ref
 v_ref = 0.65
+v_cruise = v_ref
 K_p = 0.4
 K_i = 0.56
 K_d = 1.2
+useBrakingPlanner = True
+redArea = 0.55
+stopArea = 0.50
+usePhaseAdvisor = True
+trafficLights = {'light0': (2.43, 1.67), 'light1': (-2.17, 0.67)}
 
 # ===== Steering Controller Parameters
 # - enableSteeringControl: whether or not to enable steering control
 # - K_stanley: K gain for stanley controller
 # - nodeSequence: list of nodes from roadmap. Used for trajectory generation.
+# - gpsLatency: seconds from a GPS measurement to QCarGPS reporting it, used
+#   to roll fixes forward (gps_ingest.py). 0 until it is measured on the car
 enableSteeringControl = True
 K_stanley = 1
 nodeSequence = [10,2,4,20,22,10]
+gpsLatency = 0.0
+
+# ===== Perception Parameters
+# - detectorConf: detector confidence threshold
+# - detectorImgsz: detector input size (longest side) in pixels
+# - useEvidence: decide from evidence accumulated over recent frames
+#   (evidence.py) instead of a single frame. This is what allows a lower
+#   detectorConf and detectorImgsz without false stops; with it off, use
+#   detectorConf = 0.7
+# - waitForPerception: hold the car after startDelay until the detector is
+#   loaded and warm
+# - hueWindow, satValWindow: half widths of the HSV windows that tell a lit
+#   lamp from an unlit one (light_colour.py). Check changes to these,
+#   detectorConf and detectorImgsz with perception_eval.py
+# - useFrameBus: read camera frames published by frame_bus.py (run it first)
+#   instead of opening the RealSense here, so other programs can share them
+detectorConf = 0.5
+detectorImgsz = 640
+hueWindow = 10
+satValWindow = 40
+useEvidence = True
+waitForPerception = True
+useFrameBus = False
+
+# ===== Thread Budget
+# - controlCores: CPU cores reserved for controlLoop. torch, OpenCV and the
+#   perception/GUI loop get the remaining cores (see thread_budget.py)
+controlCores = 1
 
 
 #endregion
 # -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- --
 
 #region : Initial setup
+# Whole-run scope data, full detail for recent samples and min/max (or mean
+# for the trajectory) for older ones, in memory that doesn't grow
+scopeHistory = {name: SignalHistory() for name in
+    ['v_meas', 'v_ref', 'u', 'x_meas', 'y_meas', 'th_meas', 'delta']}
+trajectory = SignalHistory(width=2, reduce='mean')
+
+threadBudget = ThreadBudget(controlCores=controlCores)
+
+# Time from start to each milestone, appended to startup_log.csv every run
+startupLog = StartupLog(['first control tick', 'perception ready', 'first decision'])
+
+# The detector and its input buffers. Importing torch/ultralytics, loading the
+# weights and the first (slow) inference take seconds, so they run on a
+# background thread while the controller and the camera come up
+model = None
+ingest = None
+def load_perception():
+    global model, ingest
+    # Must run before the first inference so torch's threads start on the
+    # inference cores
+    threadBudget.apply()
+    from ultralytics import YOLO
+    from frame_ingest import FrameIngest
+    # Preallocated input tensor and crop buffers for the 640x480 RealSense frames
+    ingest = FrameIngest(frameWidth=640, frameHeight=480, imgsz=detectorImgsz)
+    model = YOLO('yolov8s.pt')
+    # Warm-up: the first inference pays for CUDA/cuDNN set-up and fusing
+    model(ingest.prepare(np.zeros((480, 640, 3), dtype=np.uint8)),
+          classes=[9,11], conf=detectorConf, verbose=False)
+    # Again for the thread pools the warm-up started: on Windows they don't
+    # inherit the inference cores
+    threadBudget.apply()
+    startupLog.mark('perception ready')
+perception = BackgroundLoad(load_perception)
+
+landmarkEvidence = EvidenceAccumulator(['stop_sign', 'light_red'])
+# (box area percent, 'stop_sign' or 'light_red') of the nearest landmark
+# behind the last 'stop' decision, None if that frame had none
+stopTarget = None
+# True if the last frame run showed a traffic light green
+lightGreen = False
+brakingPlanner = BrakingPlanner(clock, maxThrottle=SpeedController().maxThrottle)
+
 if enableSteeringControl:
     roadmap = SDCSRoadMap(leftHandTraffic=False)
     waypointSequence = roadmap.generate_path(nodeSequence)
     initialPose = roadmap.get_node_pose(nodeSequence[0]).squeeze()
+    # Lap time, splits between the nodes of nodeSequence, stops and
+    # cross-track error, updated by controlLoop
+    lapMetrics = LapMetrics(
+        waypointSequence,
+        splits=split_indices(
+            waypointSequence,
+            [roadmap.get_node_pose(n).squeeze()[:2] for n in nodeSequence]),
+        names=nodeSequence
+    )
+    # Lateral detours around cones, precomputed so switching costs nothing
+    detours = DetourLibrary(waypointSequence)
+    lightAdvisor = LightPhaseAdvisor(waypointSequence, trafficLights, clock)
+    # New routes for the running steering controller: routeHandOff.request()
+    # from any thread, switched to by controlLoop before its next steering update
+    routeHandOff = RouteHandOff(listeners=[lapMetrics, detours, lightAdvisor])
     # roadmap.scale = 0.002000
     # print(roadmap.scale)
 else:
@@ -81,153 +210,29 @@ else:
 # Used to enable safe keyboard triggered shutdown
 global STOP_QCAR
 STOP_QCAR = False
+# Set by perception when a cone is ahead; controlLoop switches to a detour
+global AVOID_CONE
+AVOID_CONE = False
 global KILL_THREAD
 KILL_THREAD = False
 def sig_handler(*args):
     global KILL_THREAD
     KILL_THREAD = True
 signal.signal(signal.SIGINT, sig_handler)
-#endregion
-
-class SpeedController:
-
-    def __init__(self, kp=0, ki=0, kd=0):
-        self.maxThrottle = 0.3
-
-        self.kp = kp
-        self.ki = ki
-        self.kd = kd
-        
-        self.prev_e = 0
-        
-        
-
-        self.ei = 0
-        
-
-    # ==============  SECTION A -  Speed Control  ====================
-    def update(self, v, v_ref, dt):
-        
-        e = v_ref - v
-        self.ei += dt*e
-        ed = e -self.prev_e  
-        #ed = (e - self.prev_e) / dt if dt != 0 else 0
-        self.prev_e = e
-        
-
-        
-        return np.clip(
-            self.kp*e + self.ki*self.ei+ self.kd*ed,
-            -self.maxThrottle,
-            self.maxThrottle
-        )
-        
-        return 0
-
-class SteeringController:
-
-    def __init__(self, waypoints, k=1, cyclic=True):
-        self.maxSteeringAngle = np.pi/6
-
-        self.wp = waypoints
-        self.N = len(waypoints[0, :])
-        self.wpi = 0
-
-        self.k = k
-        self.cyclic = cyclic
-
-        self.p_ref = (0, 0)
-        self.th_ref = 0
-
-    # ==============  SECTION B -  Steering Control  ====================
-    # def update(self, p, th, speed):
-    #     wp_1 = self.wp[:, np.mod(self.wpi, self.N-1)]
-    #     wp_2 = self.wp[:, np.mod(self.wpi+1, self.N-1)]
-    #     # if self.wpi in range (0,300):
-    #     #     print(wp_1)
-    #     #     print(wp_2)
-    #     #     print(wp_1 - wp_2)
-
-
-    #     v = wp_2 - wp_1
-    #     v_mag = np.linalg.norm(v)
-    #     try:
-    #         v_uv = v / v_mag
-    #     except ZeroDivisionError:
-    #         return 0
-
-    #     tangent = np.arctan2(v_uv[1], v_uv[0])
-
-    #     s = np.dot(p-wp_1, v_uv)
-    #     # print(wp_1)
-
-    #     if s >= v_mag:
-    #         if  self.cyclic or self.wpi < self.N-2:
-    #             self.wpi += 1
-    #             # print(self.wpi)
-    #         # elif  self.wpi == self.N-2:
-    #         #     print("5555555555555555555555555555555555555555555555555")
-    #         # else:
-    #         #     pass
-    #     # if  self.wpi == self.N-2:
-    #     #     lap_time_elapsed = True
-    #         # print("5555555555555555555555555555555555555555555555555")
-    #     ep = wp_1 + v_uv*s
-    #     ct = ep - p
-    #     dir = wrap_to_pi(np.arctan2(ct[1], ct[0]) - tangent)
-
-    #     ect = np.linalg.norm(ct) * np.sign(dir)
-    #     psi = wrap_to_pi(tangent-th)
-
-    #     self.p_ref = ep
-    #     self.th_ref = tangent
-
-    #     return np.clip(
-    #         wrap_to_pi(psi + np.arctan2(self.k*ect, speed)),
-    #         -self.maxSteeringAngle,
-    #         self.maxSteeringAngle)
-        
-    #     return 0
-    def update(self, p, th, speed):
-        wp_1 = 0.98*self.wp[:, np.mod(self.wpi, self.N-1)]
-        wp_2 = 0.98*self.wp[:, np.mod(self.wpi+1, self.N-1)]
-       
-        v = wp_2 - wp_1
-        v_mag = np.linalg.norm(v)
-        try:
-            v_uv = v / v_mag
-        except ZeroDivisionError:
-            return 0
 
-        tangent = np.arctan2(v_uv[1], v_uv[0])
-
-        s = np.dot(p-wp_1, v_uv)
-
-        if s >= v_mag:
-            if  self.cyclic or self.wpi < self.N-2:
-                self.wpi += 1
-
-        ep = wp_1 + v_uv*s
-        ct = ep - p
-        dir = wrap_to_pi(np.arctan2(ct[1], ct[0]) - tangent)
-
-        ect = np.linalg.norm(ct) * np.sign(dir)
-        psi = wrap_to_pi(tangent-th)
-
-        self.p_ref = ep
-        self.th_ref = tangent
-
-        return np.clip(
-            wrap_to_pi(psi + np.arctan2(self.k*ect, speed)),
-            -self.maxSteeringAngle,
-            self.maxSteeringAngle)
-        
-        return 0
+# Scopes, set up under __main__. controlLoop only samples them when they
+# exist, so it also runs headless (e.g. with a VirtualClock)
+speedScope = None
+steeringScope = None
+arrow = None
+#endregion
 
-def controlLoop():
+def controlLoop(qcar=None, gps=None, ekf=None):
     #region controlLoop setup
+    threadBudget.pin('control')
     global KILL_THREAD
     global STOP_QCAR
+    global AVOID_CONE
     global v_ref
     u = 0
     delta = 0
@@ -253,156 +258,194 @@ def controlLoop():
     #endregion
 
     #region QCar interface setup
-    qcar = QCar(readMode=1, frequency=controllerUpdateRate)
+    # qcar, gps and ekf can be passed in to run against stand-in sensors
+    if qcar is None:
+        qcar = QCar(readMode=1, frequency=controllerUpdateRate)
     if enableSteeringControl:
-        ekf = QCarEKF(x_0=initialPose)
-        gps = QCarGPS(initialPose=initialPose)
+        if ekf is None:
+            ekf = QCarEKF(x_0=initialPose)
+        if gps is None:
+            gps = QCarGPS(initialPose=initialPose)
+        # Fixes are read on their own thread and picked up here when new
+        gpsIngest = GPSIngest(gps, clock, latency=gpsLatency, budget=threadBudget)
     else:
         gps = memoryview(b'')
     #endregion
 
     with qcar, gps:
-        t0 = time.time()
-        t=0
-        timestop=0
-        while (t < tf+startDelay) and (not KILL_THREAD):
-            #region : Loop timing update
-            tp = t
-            t = time.time() - t0
-            dt = t-tp
-            #endregion
-
-            #region : Read from sensors and update state estimates
-            qcar.read()
+        try:
             if enableSteeringControl:
-                if gps.readGPS():
-                    y_gps = np.array([
-                        gps.position[0],
-                        gps.position[1],
-                        gps.orientation[2]
-                    ])
+                gpsIngest.start()
+            t0 = clock.time()
+            t=0
+            timestop=0
+            while (t < tf+startDelay) and (not KILL_THREAD):
+                #region : Loop timing update
+                tp = t
+                t = clock.time() - t0
+                dt = t-tp
+                #endregion
+
+                #region : Read from sensors and update state estimates
+                qcar.read()
+                if enableSteeringControl:
+                    fix = gpsIngest.take()
+                    if fix is not None:
+                        # where the car is now, not where it was when the fix came
+                        y_gps = GPSIngest.compensate(
+                            fix, clock.time(), qcar.motorTach, delta)
+                    else:
+                        y_gps = None
                     ekf.update(
                         [qcar.motorTach, delta],
                         dt,
                         y_gps,
                         qcar.gyroscope[2],
                     )
-                else:
-                    ekf.update(
-                        [qcar.motorTach, delta],
-                        dt,
-                        None,
-                        qcar.gyroscope[2],
-                    )
-
-                x = ekf.x_hat[0,0]
-                y = ekf.x_hat[1,0]
-                th = ekf.x_hat[2,0]
-                p = ( np.array([x, y])
-                    + np.array([np.cos(th), np.sin(th)]) * 0.2)
-            v = qcar.motorTach
-            #endregion
-
-            #region : Update controllers and write to car
-            # if lap_time_elapsed:
-            #     print(t)
-            if t < startDelay:
-                u = 0
-                delta = 0
-            else:
-                if STOP_QCAR :
-                    # print("2222222222222222222222222222222222222222")
-                    v_ref=0
-                    timestop= t
-                    # LEDs = np.array([0, 0, 0, 0, 1, 1, 0, 0])
-                    # LEDs = np.array([0, 0, 0, 0, 1, 1, 0, 0])
-		            # qcar.read_write_std(QCarCommand[0],QCarCommand[1],)
-                    STOP_QCAR = False
 
+                    x = ekf.x_hat[0,0]
+                    y = ekf.x_hat[1,0]
+                    th = ekf.x_hat[2,0]
+                    p = ( np.array([x, y])
+                        + np.array([np.cos(th), np.sin(th)]) * 0.2)
+                v = qcar.motorTach
                 #endregion
-                if t - timestop >= 3.0 and v_ref == 0 :
-                    v_ref=0.65
-                    LEDs = np.array([0, 0, 0, 0, 0, 0, 0, 0])
-                elif t - timestop <= 3.0 and timestop != 0:
-                    LEDs = np.array([0, 0, 0, 0, 1, 1, 0, 0])
-                else:
-                    # LEDs = None
-                    pass
-                    # pass
-                u = speedController.update(v, v_ref, dt)
-
 
-                #region : Steering controller update
-                if enableSteeringControl:
-                    delta = steeringController.update(p, th, v)
-                else:
+                #region : Update controllers and write to car
+                # if lap_time_elapsed:
+                #     print(t)
+                try:
+                    perceptionReady = perception.ready()
+                except Exception as e:
+                    # the detector failed to load; don't drive blind
+                    print('Perception failed to load, stopping: %r' % e)
+                    qcar.write(0, 0, LEDs)
+                    break
+                if t < startDelay or (waitForPerception and not perceptionReady):
+                    u = 0
                     delta = 0
+                else:
+                    v_cmd = v_ref
+                    paced = False
+                    if usePhaseAdvisor and enableSteeringControl:
+                        # pace the approach to the next light to arrive on green
+                        v_cmd = lightAdvisor.update(steeringController.wpi, v_ref)
+                        paced = lightAdvisor.arrivesOnGreen
+                    if useBrakingPlanner and v_ref != 0:
+                        # slow down along the braking profile, hold at the line.
+                        # Red light plans are dropped while paced; stop signs never
+                        v_brake = brakingPlanner.update(v, dt, v_ref,
+                            ignore='light_red' if paced else None)
+                        if v_brake == 0:
+                            STOP_QCAR = True
+                        v_cmd = min(v_cmd, v_brake)
+                    if STOP_QCAR :
+                        # print("2222222222222222222222222222222222222222")
+                        v_ref=0
+                        timestop= t
+                        # LEDs = np.array([0, 0, 0, 0, 1, 1, 0, 0])
+                        # LEDs = np.array([0, 0, 0, 0, 1, 1, 0, 0])
+    		            # qcar.read_write_std(QCarCommand[0],QCarCommand[1],)
+                        STOP_QCAR = False
+
+                    #endregion
+                    if t - timestop >= 3.0 and v_ref == 0 :
+                        v_ref=v_cruise
+                        LEDs = np.array([0, 0, 0, 0, 0, 0, 0, 0])
+                    elif t - timestop <= 3.0 and timestop != 0:
+                        LEDs = np.array([0, 0, 0, 0, 1, 1, 0, 0])
+                    else:
+                        # LEDs = None
+                        pass
+                        # pass
+                    u = speedController.update(v, min(v_ref, v_cmd), dt)
+
+
+                    #region : Steering controller update
+                    if enableSteeringControl:
+                        routeHandOff.apply(steeringController)
+                        if AVOID_CONE:
+                            detours.engage(steeringController)
+                            AVOID_CONE = False
+                        detours.update(steeringController)
+                        delta = steeringController.update(p, th, v)
+                        lapMetrics.update(t, steeringController.wpi, v_ref, p,
+                            steeringController.p_ref)
+                    else:
+                        delta = 0
+                    #endregion
+
+                # if STOP_QCAR :
+                #     print("2222222222222222222222222222222222222222")
+                #     qcar.write(0, 0)
+                #     time.sleep(3.0)
+                #     STOP_QCAR = False
+                #     # qcar.write(0.015*u, delta) 
+                #     qcar.write(0, -0.9*delta)
+                # else :
+                qcar.write(u, delta,LEDs)
+                startupLog.mark('first control tick')  # no-op after the first
                 #endregion
-
-            # if STOP_QCAR :
-            #     print("2222222222222222222222222222222222222222")
-            #     qcar.write(0, 0)
-            #     time.sleep(3.0)
-            #     STOP_QCAR = False
-            #     # qcar.write(0.015*u, delta) 
-            #     qcar.write(0, -0.9*delta)
-            # else :
-            qcar.write(u, delta,LEDs)
-            #endregion
-            #region : Update Scopes
-            count += 1
-            if count >= countMax and t > startDelay:
-                t_plot = t - startDelay
-
-                # Speed control scope
-                speedScope.axes[0].sample(t_plot, [v, v_ref])
-                speedScope.axes[1].sample(t_plot, [v_ref-v])
-                speedScope.axes[2].sample(t_plot, [u])
-
-                # Steering control scope
-                if enableSteeringControl:
-                    steeringScope.axes[4].sample(t_plot, [[p[0],p[1]]])
-
-                    p[0] = ekf.x_hat[0,0]
-                    p[1] = ekf.x_hat[1,0]
-
-                    x_ref = steeringController.p_ref[0]
-                    y_ref = steeringController.p_ref[1]
-                    th_ref = steeringController.th_ref
-
-                    x_ref = gps.position[0]
-                    y_ref = gps.position[1]
-                    th_ref = gps.orientation[2]
-
-                    steeringScope.axes[0].sample(t_plot, [p[0], x_ref])
-                    steeringScope.axes[1].sample(t_plot, [p[1], y_ref])
-                    steeringScope.axes[2].sample(t_plot, [th, th_ref])
-                    steeringScope.axes[3].sample(t_plot, [delta])
-
-
-                    arrow.setPos(p[0], p[1])
-                    arrow.setStyle(angle=180-th*180/np.pi)
-
-                count = 0
-            #endregion
-            continue
+                #region : Update Scopes
+                count += 1
+                if count >= countMax and t > startDelay:
+                    t_plot = t - startDelay
+
+                    # Speed control scope
+                    if speedScope is not None:
+                        speedScope.axes[0].sample(t_plot, [v, v_ref])
+                        speedScope.axes[1].sample(t_plot, [v_ref-v])
+                        speedScope.axes[2].sample(t_plot, [u])
+                    scopeHistory['v_meas'].append(t_plot, v)
+                    scopeHistory['v_ref'].append(t_plot, v_ref)
+                    scopeHistory['u'].append(t_plot, u)
+
+                    # Steering control scope
+                    if enableSteeringControl:
+                        trajectory.append(t_plot, p)
+
+                        p[0] = ekf.x_hat[0,0]
+                        p[1] = ekf.x_hat[1,0]
+
+                        x_ref = steeringController.p_ref[0]
+                        y_ref = steeringController.p_ref[1]
+                        th_ref = steeringController.th_ref
+
+                        _, y_fix = gpsIngest.latest()
+                        x_ref = y_fix[0]
+                        y_ref = y_fix[1]
+                        th_ref = y_fix[2]
+
+                        if steeringScope is not None:
+                            steeringScope.axes[0].sample(t_plot, [p[0], x_ref])
+                            steeringScope.axes[1].sample(t_plot, [p[1], y_ref])
+                            steeringScope.axes[2].sample(t_plot, [th, th_ref])
+                            steeringScope.axes[3].sample(t_plot, [delta])
+                        scopeHistory['x_meas'].append(t_plot, p[0])
+                        scopeHistory['y_meas'].append(t_plot, p[1])
+                        scopeHistory['th_meas'].append(t_plot, th)
+                        scopeHistory['delta'].append(t_plot, delta)
+
+
+                        if arrow is not None:
+                            arrow.setPos(p[0], p[1])
+                            arrow.setStyle(angle=180-th*180/np.pi)
+
+                    count = 0
+                #endregion
+                clock.tick(1/controllerUpdateRate)
+                continue
+        finally:
+            # also when the loop raised: no thread keeps polling a closed
+            # QCarGPS or waits on the clock
+            clock.release()
+            if enableSteeringControl:
+                gpsIngest.stop()
 
 # -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- --
 
 # -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- --
 
-# Convert HEX to RGB
-def hex_to_rgb(hex_color):
-    hex_color = hex_color.lstrip('#')
-    lv = len(hex_color)
-    return tuple(int(hex_color[i:i + lv // 3], 16) for i in range(0, lv, lv // 3))
-
-# Convert RGB to HSV
-def rgb_to_hsv(r, g, b):
-    color = np.uint8([[[b, g, r]]])
-    hsv_color = cv2.cvtColor(color, cv2.COLOR_BGR2HSV)
-    return hsv_color[0][0]
-
 # Load image
 def load_image(image_path):
     image = cv2.imread(image_path)
@@ -410,22 +453,6 @@ def load_image(image_path):
         raise ValueError(f"Could not load image {image_path}")
     return image
 
-# Calculate brightness
-def calculate_brightness(mask):
-    return np.sum(mask) / np.count_nonzero(mask) if np.count_nonzero(mask) else 0
-
-# Define the color ranges in HSV space
-green_on_hsv = rgb_to_hsv(*hex_to_rgb("#78F569"))
-green_off_hsv = rgb_to_hsv(*hex_to_rgb("#20712F"))
-red_on_hsv = rgb_to_hsv(*hex_to_rgb("#FB6B51"))
-red_off_hsv = rgb_to_hsv(*hex_to_rgb("#79414E"))
-
-# Function to create a mask for a given color
-def create_mask(hsv_image, color_hsv):
-    lower_bound = np.array([color_hsv[0] - 10, max(color_hsv[1] - 40, 100), max(color_hsv[2] - 40, 100)])
-    upper_bound = np.array([color_hsv[0] + 10, min(color_hsv[1] + 40, 255), min(color_hsv[2] + 40, 255)])
-    return cv2.inRange(hsv_image, lower_bound, upper_bound)
-
 def disI(x1,y1,x2,y2,image):
     x1, y1, x2, y2 = x1,y1,x2,y2
     # print(x1)
@@ -441,27 +468,45 @@ def disI(x1,y1,x2,y2,image):
 def process_images(yoloimage):
     if yoloimage is None:
         return
-    hsv_image = cv2.cvtColor(yoloimage, cv2.COLOR_BGR2HSV)
-    results = {}
-    masks = {
-        'green_on': create_mask(hsv_image, green_on_hsv),
-        'green_off': create_mask(hsv_image, green_off_hsv),
-        'red_on': create_mask(hsv_image, red_on_hsv),
-        'red_off': create_mask(hsv_image, red_off_hsv)
-    }
-    brightness = {color: calculate_brightness(mask) for color, mask in masks.items()}
-    light_status = 'green' if brightness['green_on'] > brightness['green_off'] else 'red'
+    hsv_image = ingest.hsv(yoloimage)
+    light_status = classify_light(hsv_image, hueWindow, satValWindow, mask=ingest.mask)
+    if usePhaseAdvisor and enableSteeringControl:
+        lightAdvisor.observe(light_status, clock.time())
     results= light_status        
     return results
 
+# Keep the nearest (largest) landmark behind this frame's 'stop'
+def stop_target(dis, landmark):
+    global stopTarget
+    if stopTarget is None or dis > stopTarget[0]:
+        stopTarget = (dis, landmark)
+
 def mainlogic(gflag,dis):
+        global lightGreen
+        # The braking planner wants every sighting it can plan from and
+        # decides itself when to brake
+        if useBrakingPlanner:
+            minRed = minStop = brakingPlanner.minArea
+        else:
+            minRed, minStop = redArea, stopArea
+        # no stop for a red light the car is being paced to reach on green,
+        # unless it is still red once the car has to brake for it: then the
+        # prediction was wrong
+        paced = usePhaseAdvisor and enableSteeringControl and lightAdvisor.arrivesOnGreen
+        if paced and gflag == "red" and dis >= minRed and (
+                not useBrakingPlanner or brakingPlanner.must_brake(dis)):
+            lightAdvisor.distrust()
+            paced = False
         if gflag == "green":
+            lightGreen = True
             return 'green'
         # elif gflag == "red" and (dis >=0.50 and dis <= 0.75):
-        elif gflag == "red" and (dis >=0.55):
+        elif gflag == "red" and (dis >=minRed) and not paced:
+            stop_target(dis, 'light_red')
             return "stop"
 
-        elif gflag == "stop" and (dis >=0.50):
+        elif gflag == "stop" and (dis >=minStop):
+            stop_target(dis, 'stop_sign')
             return "stop"
 
         else:
@@ -469,14 +514,16 @@ def mainlogic(gflag,dis):
 
 
 def mov_logic(image):
-    results = model(image,classes=[9,11],conf=0.7,verbose=False)  # return a list of Results objects
+    results = model(ingest.prepare(image),classes=[9,11],conf=detectorConf,verbose=False)  # return a list of Results objects
     # results = model(image)  # return a list of Results objects
+    if useEvidence:
+        return evidence_logic(results, image)
     # Process results list
     for result in results:
         boxes = result.boxes  # Boxes object for bounding box outputs
-        if not torch.equal(torch.tensor([]),boxes.cls):    
+        if len(boxes.cls):
             if boxes.cls[0].item()==9.0: # traffic ligth
-                x1, y1, x2, y2 = map(int, boxes.xyxy[0])  # Get bounding box coordinates
+                x1, y1, x2, y2 = ingest.to_frame(boxes.xyxy[0])  # Get bounding box coordinates
                 cropped_image = image[y1:y2, x1:x2]  #
                 dis=disI(x1,y1,x2,y2,image)
                 # print(dis([x1,y1,x2,y2],image))
@@ -485,13 +532,39 @@ def mov_logic(image):
                  
 
             elif boxes.cls[0].item()==11.0: # stop sign
-                x1, y1, x2, y2 = map(int, boxes.xyxy[0])  # Get bounding box coordinates
+                x1, y1, x2, y2 = ingest.to_frame(boxes.xyxy[0])  # Get bounding box coordinates
                 cropped_image = image[y1:y2, x1:x2]
                 # print(dis([x1,y1,x2,y2],image))
                 dis=disI(x1,y1,x2,y2,image)
                 Getflag ="stop"
                 return mainlogic(Getflag,dis)
 
+# Feed every close enough stop sign / red light of this frame into the
+# landmark evidence and stop once either hypothesis is active
+def evidence_logic(results, image):
+    observations = {}
+    for result in results:
+        boxes = result.boxes
+        for cls, conf, xyxy in zip(boxes.cls, boxes.conf, boxes.xyxy):
+            x1, y1, x2, y2 = ingest.to_frame(xyxy)
+            if x2 <= x1 or y2 <= y1:
+                continue
+            dis=disI(x1,y1,x2,y2,image)
+            if cls.item()==9.0: # traffic ligth
+                name = 'light_red'
+                Getflag = process_images(image[y1:y2, x1:x2])
+            elif cls.item()==11.0: # stop sign
+                name = 'stop_sign'
+                Getflag = "stop"
+            else:
+                continue
+            if mainlogic(Getflag,dis) == "stop":
+                observations[name] = max(observations.get(name, 0.0), conf.item())
+
+    if landmarkEvidence.update(observations):
+        return "stop"
+    return 'pass'
+
 
 # -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- -- --
 
@@ -499,6 +572,7 @@ def mov_logic(image):
 
 #region : Setup and run experiment
 if __name__ == '__main__':
+    perception.start()
 
     #region : Setup scopes
     if IS_PHYSICAL_QCAR:
@@ -515,7 +589,7 @@ if __name__ == '__main__':
     speedScope.addAxis(
         row=0,
         col=0,
-        timeWindow=tf,
+        timeWindow=scopeWindow,
         yLabel='Vehicle Speed [m/s]',
         yLim=(0, 1)
     )
@@ -525,7 +599,7 @@ if __name__ == '__main__':
     speedScope.addAxis(
         row=1,
         col=0,
-        timeWindow=tf,
+        timeWindow=scopeWindow,
         yLabel='Speed Error [m/s]',
         yLim=(-0.5, 0.5)
     )
@@ -534,7 +608,7 @@ if __name__ == '__main__':
     speedScope.addAxis(
         row=2,
         col=0,
-        timeWindow=tf,
+        timeWindow=scopeWindow,
         xLabel='Time [s]',
         yLabel='Throttle Command [%]',
         yLim=(-0.3, 0.3)
@@ -553,7 +627,7 @@ if __name__ == '__main__':
         steeringScope.addAxis(
             row=0,
             col=0,
-            timeWindow=tf,
+            timeWindow=scopeWindow,
             yLabel='x Position [m]',
             yLim=(-2.5, 2.5)
         )
@@ -563,7 +637,7 @@ if __name__ == '__main__':
         steeringScope.addAxis(
             row=1,
             col=0,
-            timeWindow=tf,
+            timeWindow=scopeWindow,
             yLabel='y Position [m]',
             yLim=(-1, 5)
         )
@@ -573,7 +647,7 @@ if __name__ == '__main__':
         steeringScope.addAxis(
             row=2,
             col=0,
-            timeWindow=tf,
+            timeWindow=scopeWindow,
             yLabel='Heading Angle [rad]',
             yLim=(-3.5, 3.5)
         )
@@ -583,7 +657,7 @@ if __name__ == '__main__':
         steeringScope.addAxis(
             row=3,
             col=0,
-            timeWindow=tf,
+            timeWindow=scopeWindow,
             yLabel='Steering Angle [rad]',
             yLim=(-0.6, 0.6)
         )
@@ -620,7 +694,13 @@ if __name__ == '__main__':
         steeringScope.axes[4].plot.addItem(referencePath)
         referencePath.setData(waypointSequence[0, :],waypointSequence[1, :])
 
-        steeringScope.axes[4].attachSignal(name='Estimated', width=2)
+        # Drawn from the bounded trajectory history rather than a scope
+        # signal, which would keep every point of the run
+        estimatedPath = pg.PlotDataItem(
+            pen={'width': 2},
+            name='Estimated'
+        )
+        steeringScope.axes[4].plot.addItem(estimatedPath)
 
         arrow = pg.ArrowItem(
             angle=180,
@@ -638,33 +718,90 @@ if __name__ == '__main__':
     #region : Setup control thread, then run experiment
 
     controlThread = Thread(target=controlLoop)
-    controlThread.start()
     COUNTER=0
     imageWidth  = 640
     imageHeight = 480
-    myCam  = QCarRealSense(mode='RGB&DEPTH',
-            frameWidthRGB=imageWidth,
-            frameHeightRGB=imageHeight)
-    t0 = time.time() 
+    framePeriod = 1/30
+    # Reuse the last decision while the view hasn't changed
+    signGate = FrameGate(clock=clock)
+    if enableSteeringControl:
+        def lap_done(lap):
+            gate = signGate.new_lap()
+            print('Lap %d: %.2f s, %d sign inferences saved' % (lap['lap'], lap['lap_time'], gate['saved']))
+        lapMetrics.onLap = lap_done
     tstop=-1.0
     FLAG='pass'
+    myCam = None
     # coun
     try:
+        # The perception loop below runs in lockstep with controlLoop when the
+        # clock is virtual
+        clock.register()
+        controlThread.start()
+        if useFrameBus:
+            myCam = BusCamera()
+        else:
+            myCam  = QCarRealSense(mode='RGB&DEPTH',
+                    frameWidthRGB=imageWidth,
+                    frameHeightRGB=imageHeight)
+        threadBudget.pin('inference')
+        t0 = clock.time()
+        tPath = -pathRefresh
         while controlThread.is_alive() and (not KILL_THREAD):
-            qtime = time.time() - t0
+            qtime = clock.time() - t0
             # COUNTER +=1
             # print(COUNTER)
+            if enableSteeringControl and qtime - tPath >= pathRefresh:
+                trajectory.plot_xy(estimatedPath)
+                tPath = qtime
             MultiScope.refreshAll()
+            # latency is counted from the start of the read, so getting the
+            # frame counts too
+            tFrame = clock.time()
             myCam.read_RGB()
             # cv2.imshow("T",myCam.imageBufferRGB)
-            FLAG=mov_logic(myCam.imageBufferRGB)
-            if FLAG =='stop' and (qtime -tstop)>=7.00:
+            # No decisions until the detector is warm
+            detected = False
+            # no frame yet if the camera timed out on the first one
+            if perception.ready() and myCam.imageBufferRGB is not None:
+                FLAG=signGate.run(myCam.imageBufferRGB, mov_logic)
+                detected = signGate.fresh
+                startupLog.mark('first decision')
+            if useBrakingPlanner:
+                # reused results took no time; they'd pull the average down
+                if detected:
+                    brakingPlanner.observe_latency(clock.time() - tFrame)
+                if FLAG =='stop' and stopTarget is not None:
+                    brakingPlanner.target(*stopTarget)
+                # a light that turned green is no reason to stop; red-light
+                # plans that stop being seen also time out in the planner
+                if detected and lightGreen and (
+                        stopTarget is None or stopTarget[1] != 'light_red'):
+                    brakingPlanner.cancel('light_red')
+                stopTarget = None
+                lightGreen = False
+            elif FLAG =='stop' and (qtime -tstop)>=7.00:
                 STOP_QCAR=True
                 tstop=qtime
-                time.sleep(4.0)
+                clock.sleep(4.0)
+            clock.pace(framePeriod)
 # fjf  go tr
     finally:
         KILL_THREAD = True
+        clock.unregister()
+        # no thread is left asleep waiting for a tick that may not come
+        clock.release()
+        if myCam is not None:
+            # frees the camera, or this reader's entry on the frame bus
+            myCam.terminate()
+        print('Startup: ' + startupLog.report())
+        print('Sign detector: ' + signGate.report())
+        print(threadBudget.report())
+        save_histories(scopeHistoryFile, dict(scopeHistory, trajectory=trajectory))
+        if enableSteeringControl:
+            print(lapMetrics.report())
+            print(lightAdvisor.report())
+            lapMetrics.save('lap_report.json')
     # #endregion
     # if not IS_PHYSICAL_QCAR:
     #     qlabs_setup.terminate()
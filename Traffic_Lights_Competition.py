@@ -5,6 +5,7 @@ from quanser.communications import Stream
 
 from qvl.qlabs import QuanserInteractiveLabs
 from qvl.traffic_light import QLabsTrafficLight
+from light_scheduler import LightScheduler, PhasePlan
 
 # creates a server connection with Quanser Interactive Labs and manages the communications
 qlabs = QuanserInteractiveLabs()
@@ -28,19 +29,16 @@ TrafficLight1 = QLabsTrafficLight(qlabs)
 TrafficLight1.spawn_degrees([-2.3 + x_offset, -1 + y_offset, 0], [0, 0, 180], scale=[.1, .1, .1], configuration=0, waitForConfirmation=True)
 TrafficLight1.set_state(QLabsTrafficLight.STATE_RED)
 
-i = 0
-while (True):
-    i=i+1
-    print (i)
+# Each light alternates green/red every 5 s, light 0 half a cycle behind
+# light 1. More lights or other phase plans are just more add_light calls.
+scheduler = LightScheduler()
+scheduler.add_light('light0', TrafficLight0, PhasePlan(green=5, yellow=0, red=5, offset=5))
+scheduler.add_light('light1', TrafficLight1, PhasePlan(green=5, yellow=0, red=5, offset=0))
 
-    if i % 2 == 0:
-        TrafficLight0.set_state(QLabsTrafficLight.STATE_GREEN)
-        TrafficLight1.set_state(QLabsTrafficLight.STATE_RED)
-    else:
-        TrafficLight1.set_state(QLabsTrafficLight.STATE_GREEN)
-        TrafficLight0.set_state(QLabsTrafficLight.STATE_RED)
-
-    time.sleep(5)
+try:
+    scheduler.run()
+except KeyboardInterrupt:
+    pass
 
 qlabs.close()
 print("Done!")
@@ -0,0 +1,143 @@
+"""
+braking.py
+
+Speed-aware braking for stop signs and red lights.
+
+Perception reports each sighting of a landmark the car has to stop at with
+the area of its box (percent of the frame, as disI computes it).
+BrakingPlanner turns that into a distance to the stop point, takes off what
+the car covered during the measured perception latency, and from then on
+dead-reckons the remaining distance with motorTach every control tick. The
+speed reference is capped at sqrt(2*a*d), the fastest speed from which the
+car can still stop within d at the deceleration a the throttle limit allows,
+so the car cruises at v_ref until the latest safe braking point and then
+follows a smooth ramp down to the stop point instead of a step to 0. The
+last few centimetres are covered at creepSpeed so the speed loop's lag
+can't leave the car short of the point.
+
+Each plan is tagged with its landmark ('stop_sign' or 'light_red'), so the
+control loop can drop red-light plans while the light advisor paces the car
+to arrive on green (update's ignore) without touching a stop-sign plan. A
+red-light plan is also dropped when perception sees the light green
+(cancel) or hasn't seen it red for lostAfter seconds. Stop-sign plans don't
+time out: the sign doesn't change, and it leaves the camera's view as the
+car nears the line.
+
+Box area to distance uses the pinhole relation, area ~ 1/d**2, calibrated
+by one reference pair (refArea, refDistance): park the car at a known
+distance from a sign and read off the area.
+"""
+
+# region: package imports
+import math
+
+#endregion
+
+# Same plant approximation as gain_sweep.py: steady state speed per unit
+# throttle over the motor time constant
+DECEL_PER_THROTTLE = 5.0 / 0.25     # m/s^2
+
+
+class BrakingPlanner:
+
+    # maxThrottle: SpeedController.maxThrottle; comfort: fraction of the
+    # resulting deceleration to plan with
+    # stopMargin: metres short of the landmark to stop
+    # minArea: smallest box area (percent) reliable enough to plan from
+    # cooldown: seconds after a stop during which sightings are ignored, so
+    # the landmark just stopped at doesn't trigger again
+    # lostAfter: seconds without a red sighting after which a red-light plan
+    # is dropped
+    # clock: the run's clock (see clock.py)
+    def __init__(self, clock, maxThrottle=0.3, comfort=0.3, stopMargin=0.3,
+                 refArea=0.55, refDistance=0.9, minArea=0.1, cooldown=7.0,
+                 creepSpeed=0.1, latencyAlpha=0.2, lostAfter=1.0):
+        self.clock = clock
+        self.decel = comfort * DECEL_PER_THROTTLE * maxThrottle
+        self.stopMargin = stopMargin
+        self.refArea = refArea
+        self.refDistance = refDistance
+        self.minArea = minArea
+        self.cooldown = cooldown
+        self.creepSpeed = creepSpeed
+        self.latencyAlpha = latencyAlpha
+        self.lostAfter = lostAfter
+
+        self.latency = 0.0
+        self.v = 0.0
+        self.remaining = None
+        self.landmark = None
+        self._measured = None
+        self._cancel = None
+        self._tSeen = -math.inf
+        self._ignoreUntil = -math.inf
+
+    # Distance to a landmark whose box covers area percent of the frame
+    def distance(self, area):
+        return self.refDistance * math.sqrt(self.refArea / area)
+
+    # Distance needed to stop from speed v
+    def braking_distance(self, v):
+        return v * v / (2 * self.decel)
+
+    # Perception loop: time from frame capture to decision
+    def observe_latency(self, seconds):
+        self.latency += self.latencyAlpha * (seconds - self.latency)
+
+    # Perception loop: True once a landmark with box area percent is no
+    # further away than the car needs to stop from its current speed, with
+    # slack seconds of travel for the stop decision to get through (the
+    # evidence filter needs a few frames)
+    def must_brake(self, area, slack=0.3):
+        d = self.distance(area) - self.stopMargin - self.v * self.latency
+        return d <= self.braking_distance(self.v) + self.v * slack
+
+    # Perception loop: landmark ('stop_sign' or 'light_red') to stop at was
+    # seen with box area percent
+    def target(self, area, landmark='stop_sign'):
+        if area < self.minArea or self.clock.time() < self._ignoreUntil:
+            return
+        d = self.distance(area) - self.stopMargin - self.v * self.latency
+        self._tSeen = self.clock.time()
+        # picked up by the control thread on its next tick
+        self._measured = (max(d, 0.0), landmark)
+
+    # Perception loop: landmark is no longer a reason to stop (a red light
+    # seen green); drop its plan on the next tick. Any plan if None
+    def cancel(self, landmark=None):
+        measured = self._measured
+        if measured is not None and landmark in (None, measured[1]):
+            self._measured = None
+        self._cancel = (landmark,)
+
+    def _drop(self):
+        self.remaining = None
+        self.landmark = None
+
+    # controlLoop, every tick: the speed reference to use instead of v_ref.
+    # Returns 0 once the stop point is reached. ignore: landmark whose plans
+    # are dropped this tick, e.g. 'light_red' while the car is paced to
+    # arrive on green
+    def update(self, v, dt, v_ref, ignore=None):
+        self.v = v
+        measured = self._measured
+        if measured is not None:
+            self._measured = None
+            if measured[1] != ignore:
+                self.remaining, self.landmark = measured
+        cancel = self._cancel
+        if cancel is not None:
+            self._cancel = None
+            if cancel[0] in (None, self.landmark):
+                self._drop()
+        if self.landmark is not None and (self.landmark == ignore or (
+                self.landmark == 'light_red' and self.clock.time() - self._tSeen > self.lostAfter)):
+            self._drop()
+        if self.remaining is None:
+            return v_ref
+        self.remaining -= v * dt
+        if self.remaining <= 0:
+            self._drop()
+            self._ignoreUntil = self.clock.time() + self.cooldown
+            return 0.0
+        return min(v_ref, max(math.sqrt(2 * self.decel * self.remaining), self.creepSpeed))
@@ -0,0 +1,115 @@
+"""
+clock.py
+
+Time sources for controlLoop and the perception loop.
+
+RealTimeClock is wall-clock time; tick() and pace() do nothing because the car
+and the camera set the pace.
+
+VirtualClock is stepped: time only moves when the driving thread (controlLoop)
+calls tick(dt). Other threads register() with the clock and their sleep()
+and pace() calls block until virtual time reaches the deadline. tick() waits
+for every registered thread to be asleep before advancing, and again after
+waking the ones that are due, so each thread runs in lockstep with the
+controller and a run gives the same result every time, as fast as the CPU
+allows.
+"""
+
+# region: package imports
+import heapq
+import time
+from threading import Condition
+
+#endregion
+
+
+class RealTimeClock:
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    # Called once per control step
+    def tick(self, dt):
+        pass
+
+    # Called once per perception frame
+    def pace(self, period):
+        pass
+
+    def register(self):
+        pass
+
+    def unregister(self):
+        pass
+
+    def release(self):
+        pass
+
+
+class VirtualClock:
+
+    def __init__(self, t0=0.0):
+        self._t = t0
+        self._cond = Condition()
+        # registered threads that are currently running (not sleeping)
+        self._running = 0
+        self._sleepers = []
+        self._seq = 0
+        self._released = False
+
+    def time(self):
+        return self._t
+
+    def register(self):
+        with self._cond:
+            self._running += 1
+
+    def unregister(self):
+        with self._cond:
+            self._running -= 1
+            self._cond.notify_all()
+
+    # Block a registered thread until virtual time has advanced by seconds
+    def sleep(self, seconds):
+        with self._cond:
+            if self._released:
+                return
+            self._seq += 1
+            entry = [self._t + seconds, self._seq, False]
+            heapq.heappush(self._sleepers, entry)
+            self._running -= 1
+            self._cond.notify_all()
+            while not entry[2]:
+                self._cond.wait()
+
+    def pace(self, period):
+        self.sleep(period)
+
+    # Advance virtual time by dt, letting every due thread run to its next sleep
+    def tick(self, dt):
+        with self._cond:
+            self._wait_idle()
+            self._t += dt
+            while self._sleepers and self._sleepers[0][0] <= self._t + 1e-12:
+                entry = heapq.heappop(self._sleepers)
+                entry[2] = True
+                self._running += 1
+            self._cond.notify_all()
+            self._wait_idle()
+
+    # Called by the driving thread when it stops ticking, so no thread is left
+    # waiting for a time that will never come
+    def release(self):
+        with self._cond:
+            self._released = True
+            for entry in self._sleepers:
+                entry[2] = True
+            self._sleepers = []
+            self._cond.notify_all()
+
+    def _wait_idle(self):
+        while self._running > 0:
+            self._cond.wait()
@@ -1,7 +1,12 @@
 from ultralytics import YOLO
 import cv2
 import torch
+from frame_gate import FrameGate
 model = YOLO('Cone.pt')
+# Detector confidence threshold (check changes with perception_eval.py)
+coneConf = 0.65
+# Skips the cone detector on frames that barely changed since its last run
+coneGate = FrameGate()
 
 # Load a model
 def dis(xyxy,image):
@@ -17,10 +22,16 @@ def dis(xyxy,image):
     return round(distance,1)
 
 def conedetact(image):
+    return coneGate.run(image, _conedetact)
+
+def _conedetact(image):
+    results = model(image,conf=coneConf,verbose=False)  # return a list of Results objects
+    return cone_decision([result.boxes for result in results], image)
+
+# 'cone' or 'pass' from the detector's boxes for image
+def cone_decision(boxesList, image):
     disv=0
-    results = model(image,conf=0.65,verbose=False)  # return a list of Results objects
-    for result in results:
-        boxes = result.boxes  # Boxes object for bounding box outputs
+    for boxes in boxesList:  # Boxes object for bounding box outputs
         if not torch.equal(torch.tensor([]),boxes.cls):    
                 if boxes.cls[0].item()==0.0: # traffic ligth
                     print('333333333333333333333333333333333')
@@ -0,0 +1,118 @@
+"""
+detour_paths.py
+
+Precomputed lateral detours around obstacles (cones) on waypointSequence.
+
+At start-up DetourLibrary builds, for every station (one every
+stationSpacing metres along the path) and every lateral offset, a copy of the
+path that merges out to the offset with a smooth cosine ramp, holds it past
+the station and merges back in. All copies have the same length as the
+original path, so waypoint index wpi means the same place on every one of
+them, and they live in one preallocated array.
+
+At run time engage() picks the station and offset with integer arithmetic
+and points SteeringController.wp at that copy; update() puts the original
+path back once the car is past the merge-in. Neither allocates or searches,
+so avoidance costs nothing per tick. The detours only exist for this one
+path: after a route hand-off (route_changed) engage() does nothing until
+the controller is back on it.
+"""
+
+# region: package imports
+import numpy as np
+
+#endregion
+
+
+# Unit left-hand normals of a 2xN path
+def path_normals(waypoints):
+    tangent = np.gradient(waypoints, axis=1)
+    norm = np.hypot(tangent[0], tangent[1])
+    norm[norm == 0] = 1.0
+    return np.vstack((-tangent[1] / norm, tangent[0] / norm))
+
+
+# Lateral shift (as a fraction of the offset) for each waypoint index, for a
+# detour whose hold section starts at station
+def detour_profile(n, station, ramp, hold):
+    # position relative to the start of the merge-out, wrapped so detours
+    # near the end of the lap run over into its start
+    i = (np.arange(n) - (station - ramp)) % n
+    profile = np.zeros(n)
+    out = i < ramp
+    profile[out] = 0.5 - 0.5*np.cos(np.pi * i[out] / ramp)
+    held = (i >= ramp) & (i < ramp + hold)
+    profile[held] = 1.0
+    back = (i >= ramp + hold) & (i < 2*ramp + hold)
+    profile[back] = 0.5 + 0.5*np.cos(np.pi * (i[back] - ramp - hold) / ramp)
+    return profile
+
+
+class DetourLibrary:
+
+    # offsets: lateral offsets in metres, positive to the left
+    # rampLength / holdLength: merge and hold distances in metres
+    def __init__(self, waypoints, offsets=(-0.25, -0.15, 0.15, 0.25),
+                 stationSpacing=0.25, rampLength=0.6, holdLength=0.5):
+        self.base = waypoints
+        self.offsets = list(offsets)
+        N = len(waypoints[0, :])
+        # SteeringController indexes modulo N-1; the last point repeats the first
+        self.n = N - 1
+
+        step = np.mean(np.hypot(*np.diff(waypoints[:, :self.n + 1], axis=1)))
+        self.step = step
+        self.spacing = max(1, int(round(stationSpacing / step)))
+        self.ramp = max(1, int(round(rampLength / step)))
+        self.hold = max(1, int(round(holdLength / step)))
+        self.stations = np.arange(0, self.n, self.spacing)
+
+        normals = path_normals(waypoints[:, :self.n])
+        self.paths = np.empty((len(self.offsets), len(self.stations), 2, N))
+        for k, station in enumerate(self.stations):
+            profile = detour_profile(self.n, station, self.ramp, self.hold)
+            for j, offset in enumerate(self.offsets):
+                path = self.paths[j, k]
+                path[:, :self.n] = waypoints[:, :self.n] + normals * (offset * profile)
+                path[:, self.n] = path[:, 0]
+
+        self.active = None
+        self.enabled = True
+        self._endWpi = 0
+
+    # Switch controller onto a detour whose hold section starts about
+    # distanceAhead metres ahead (never closer than one ramp length), at the
+    # precomputed offset nearest offset. A detour already under way is kept
+    def engage(self, controller, distanceAhead=0.5, offset=0.15):
+        if not self.enabled:
+            return None
+        if self.active is not None:
+            return self.active
+        j = min(range(len(self.offsets)), key=lambda i: abs(self.offsets[i] - offset))
+        target = controller.wpi + max(int(distanceAhead / self.step), self.ramp)
+        # first station at or after target; wpi is unwrapped, stations are not
+        lapStart = (target // self.n) * self.n
+        k = -(-(target - lapStart) // self.spacing)
+        if k >= len(self.stations):
+            k = 0
+            lapStart += self.n
+        station = lapStart + self.stations[k]
+        controller.wp = self.paths[j, k]
+        self.active = (j, k)
+        self._endWpi = station + self.hold + self.ramp
+        return self.active
+
+    # Restore the original path once the detour has merged back in
+    def update(self, controller):
+        if self.active is not None and controller.wpi >= self._endWpi:
+            self.disengage(controller)
+
+    def disengage(self, controller):
+        controller.wp = self.base
+        self.active = None
+
+    # The controller was handed a new route (route_table.RouteHandOff), with
+    # wpi starting over at 0
+    def route_changed(self, waypoints):
+        self.active = None
+        self.enabled = waypoints is self.base
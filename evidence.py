@@ -0,0 +1,85 @@
+"""
+evidence.py
+
+Temporal evidence for stop/light decisions. Instead of acting on a single
+frame, each landmark hypothesis ("stop_sign", "light_red", ...) keeps a
+fixed-size ring buffer of per-frame log-odds: a detection adds
+hitBias + logit(confidence), a frame without one adds missLogOdds. The
+posterior is the prior plus the buffer sum, and the decision has hysteresis:
+it switches on above onThreshold and only switches off below offThreshold.
+
+One confident frame is no longer enough to stop the car and one missed frame
+doesn't cancel a stop, so the detector can run with a lower confidence
+threshold and a smaller input size.
+"""
+
+# region: package imports
+import numpy as np
+
+#endregion
+
+
+def logit(p):
+    p = min(max(p, 1e-3), 1 - 1e-3)
+    return np.log(p / (1 - p))
+
+
+class EvidenceTrack:
+
+    def __init__(self, size=6, prior=0.12, hitBias=1.0, missLogOdds=-0.7,
+                 onThreshold=0.8, offThreshold=0.3):
+        self.buffer = np.zeros(size)
+        self.index = 0
+        self.prior = logit(prior)
+        self.hitBias = hitBias
+        self.missLogOdds = missLogOdds
+        self.on = logit(onThreshold)
+        self.off = logit(offThreshold)
+
+        self.active = False
+        self.logOdds = self.prior
+
+    # conf: detection confidence this frame, or None if not detected
+    def update(self, conf=None):
+        if conf is None:
+            l = self.missLogOdds
+        else:
+            l = self.hitBias + logit(conf)
+        self.buffer[self.index] = l
+        self.index = (self.index + 1) % len(self.buffer)
+
+        self.logOdds = self.prior + self.buffer.sum()
+        if self.active:
+            self.active = self.logOdds > self.off
+        else:
+            self.active = self.logOdds >= self.on
+        return self.active
+
+    @property
+    def posterior(self):
+        return 1.0 / (1.0 + np.exp(-self.logOdds))
+
+    def reset(self):
+        self.buffer[:] = 0
+        self.index = 0
+        self.logOdds = self.prior
+        self.active = False
+
+
+class EvidenceAccumulator:
+
+    def __init__(self, names, **trackArgs):
+        self.tracks = {name: EvidenceTrack(**trackArgs) for name in names}
+
+    # observations: {name: confidence} for the hypotheses seen this frame;
+    # every other track records a miss
+    def update(self, observations):
+        for name, track in self.tracks.items():
+            track.update(observations.get(name))
+        return self.active()
+
+    def active(self):
+        return [name for name, track in self.tracks.items() if track.active]
+
+    def posteriors(self):
+        return {name: track.posterior for name, track in self.tracks.items()}
@@ -0,0 +1,245 @@
+"""
+fleet.py
+
+Structure-of-arrays versions of SpeedController, SteeringController and the
+gain_sweep kinematic bicycle, for simulating many cars in one process. Every
+piece of per-car state (integrator, previous error, waypoint index, pose,
+speed) and every gain is an array with one entry per car, and each tick is a
+handful of NumPy calls over the whole fleet. All cars follow the same
+waypoints; the per-segment geometry the steering law needs is computed once.
+
+The update rules are the same as the scalar controllers, so a fleet of one
+car reproduces gain_sweep.simulate.
+
+    python fleet.py --cars 500 --pose-noise 0.05 --plant-spread 0.1
+    python fleet.py --kp 0.2:0.8:5 --ki 0.3:0.9:5 --kd 0.4:1.6:4 --kstanley 0.5,1,1.5,2
+"""
+
+# region: package imports
+import argparse
+import itertools
+import time
+
+import numpy as np
+
+from gain_sweep import (CONTROLLER_RATE, LOOKAHEAD, MOTOR_GAIN, MOTOR_TAU,
+                        V_REF, WHEELBASE, load_path, parse_values, write_table)
+
+#endregion
+
+
+def wrap_to_pi(th):
+    return np.mod(th + np.pi, 2*np.pi) - np.pi
+
+
+class FleetSpeedController:
+
+    # kp, ki, kd: scalars or arrays of length n
+    def __init__(self, n, kp=0, ki=0, kd=0, maxThrottle=0.3):
+        self.maxThrottle = maxThrottle
+        self.kp = np.broadcast_to(np.asarray(kp, dtype=float), (n,))
+        self.ki = np.broadcast_to(np.asarray(ki, dtype=float), (n,))
+        self.kd = np.broadcast_to(np.asarray(kd, dtype=float), (n,))
+        self.prev_e = np.zeros(n)
+        self.ei = np.zeros(n)
+
+    def update(self, v, v_ref, dt):
+        e = v_ref - v
+        self.ei += dt*e
+        ed = e - self.prev_e
+        self.prev_e = e
+        return np.clip(
+            self.kp*e + self.ki*self.ei + self.kd*ed,
+            -self.maxThrottle,
+            self.maxThrottle
+        )
+
+
+class FleetSteeringController:
+
+    def __init__(self, n, waypoints, k=1, cyclic=True, maxSteeringAngle=np.pi/6):
+        self.maxSteeringAngle = maxSteeringAngle
+        self.k = np.broadcast_to(np.asarray(k, dtype=float), (n,))
+        self.cyclic = cyclic
+        self.N = len(waypoints[0, :])
+        self.wpi = np.zeros(n, dtype=np.int64)
+
+        # segment i runs from waypoint i to i+1 (modulo N-1), scaled by 0.98
+        # like SteeringController
+        wp = 0.98*waypoints[:, :self.N-1]
+        seg = np.roll(wp, -1, axis=1) - wp
+        mag = np.hypot(seg[0], seg[1])
+        self._start = wp
+        self._mag = mag
+        self._valid = mag > 0
+        self._unit = seg / np.where(self._valid, mag, 1.0)
+        self._tangent = np.arctan2(self._unit[1], self._unit[0])
+
+        self.p_ref = np.zeros((2, n))
+        self.th_ref = np.zeros(n)
+
+    # p: 2xn look-ahead points; th, speed: arrays of length n
+    def update(self, p, th, speed):
+        i = np.mod(self.wpi, self.N-1)
+        wp_1 = self._start[:, i]
+        v_uv = self._unit[:, i]
+        v_mag = self._mag[i]
+        valid = self._valid[i]
+        tangent = self._tangent[i]
+
+        s = np.sum((p - wp_1) * v_uv, axis=0)
+        advance = valid & (s >= v_mag)
+        if not self.cyclic:
+            advance &= self.wpi < self.N-2
+        self.wpi += advance
+
+        ep = wp_1 + v_uv*s
+        ct = ep - p
+        dir = wrap_to_pi(np.arctan2(ct[1], ct[0]) - tangent)
+        ect = np.hypot(ct[0], ct[1]) * np.sign(dir)
+        psi = wrap_to_pi(tangent - th)
+
+        self.p_ref = np.where(valid, ep, self.p_ref)
+        self.th_ref = np.where(valid, tangent, self.th_ref)
+
+        delta = np.clip(
+            wrap_to_pi(psi + np.arctan2(self.k*ect, speed)),
+            -self.maxSteeringAngle,
+            self.maxSteeringAngle)
+        # a zero-length segment steers straight, like SteeringController
+        return np.where(valid, delta, 0.0)
+
+
+class FleetBicycle:
+
+    # poses: n x 3 array of x, y, th; plant parameters scalars or arrays
+    def __init__(self, poses, wheelbase=WHEELBASE, motorGain=MOTOR_GAIN,
+                 motorTau=MOTOR_TAU, maxSteeringAngle=np.pi/6):
+        poses = np.asarray(poses, dtype=float)
+        self.x = poses[:, 0].copy()
+        self.y = poses[:, 1].copy()
+        self.th = poses[:, 2].copy()
+        self.v = np.zeros(len(poses))
+
+        self.wheelbase = wheelbase
+        self.motorGain = motorGain
+        self.motorTau = motorTau
+        self.maxSteeringAngle = maxSteeringAngle
+
+    def step(self, u, delta, dt):
+        delta = np.clip(delta, -self.maxSteeringAngle, self.maxSteeringAngle)
+        self.v += dt * (self.motorGain*u - self.v) / self.motorTau
+        self.x += dt * self.v * np.cos(self.th)
+        self.y += dt * self.v * np.sin(self.th)
+        self.th += dt * self.v / self.wheelbase * np.tan(delta)
+
+
+# Drive one lap with every car of the fleet at once and return the metrics of
+# each car, as gain_sweep.simulate does for one. gains: n x 4 array of
+# kp, ki, kd, k_stanley. plant: optional dict of per-car FleetBicycle
+# parameter arrays.
+def simulate_fleet(gains, waypoints, poses, v_ref=V_REF, rate=CONTROLLER_RATE,
+                   tmax=120.0, plant=None):
+    gains = np.asarray(gains, dtype=float)
+    n = len(gains)
+    kp, ki, kd, k_stanley = gains.T
+    speedController = FleetSpeedController(n, kp=kp, ki=ki, kd=kd)
+    steeringController = FleetSteeringController(
+        n, waypoints, k=k_stanley, cyclic=False)
+    cars = FleetBicycle(poses, **(plant or {}))
+
+    dt = 1.0 / rate
+    t = 0.0
+    steps = np.zeros(n)
+    xt_sq = np.zeros(n)
+    xt_max = np.zeros(n)
+    v_max = np.zeros(n)
+    effort = np.zeros(n)
+    lapTime = np.full(n, np.nan)
+    running = np.ones(n, dtype=bool)
+    end = steeringController.N - 2
+
+    while t < tmax and running.any():
+        p = np.vstack((cars.x + LOOKAHEAD*np.cos(cars.th),
+                       cars.y + LOOKAHEAD*np.sin(cars.th)))
+        u = speedController.update(cars.v, v_ref, dt)
+        delta = steeringController.update(p, cars.th, cars.v)
+        # finished cars stay where they are
+        u = np.where(running, u, 0.0)
+        cars.step(u, delta, dt)
+        cars.v[~running] = 0.0
+        t += dt
+
+        xt = np.hypot(*(p - steeringController.p_ref))
+        steps += running
+        xt_sq += np.where(running, xt*xt, 0.0)
+        np.maximum(xt_max, np.where(running, xt, 0.0), out=xt_max)
+        np.maximum(v_max, cars.v, out=v_max)
+        effort += np.where(running, np.abs(u), 0.0)
+
+        finished = running & (steeringController.wpi >= end)
+        lapTime[finished] = round(t, 3)
+        running &= ~finished
+
+    completed = ~np.isnan(lapTime)
+    return [{
+        'kp': kp[i], 'ki': ki[i], 'kd': kd[i], 'k_stanley': k_stanley[i],
+        'lap_time': lapTime[i],
+        'xt_rms': np.sqrt(xt_sq[i] / steps[i]),
+        'xt_max': xt_max[i],
+        'overshoot': max(0.0, v_max[i] - v_ref) / v_ref,
+        'effort': effort[i] / steps[i],
+        'completed': bool(completed[i]),
+    } for i in range(n)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Vectorised fleet simulation')
+    parser.add_argument('--kp', default='0.4')
+    parser.add_argument('--ki', default='0.56')
+    parser.add_argument('--kd', default='1.2')
+    parser.add_argument('--kstanley', default='1')
+    parser.add_argument('--cars', type=int, default=None,
+                        help='cars per gain set (default: 1 for a gain grid, 500 for one gain set)')
+    parser.add_argument('--pose-noise', type=float, default=0.0,
+                        help='std dev of the start position [m] (heading: radians/10)')
+    parser.add_argument('--plant-spread', type=float, default=0.0,
+                        help='relative std dev of motor gain, motor time constant and wheelbase')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--v-ref', type=float, default=V_REF)
+    parser.add_argument('--rate', type=float, default=CONTROLLER_RATE)
+    parser.add_argument('--tmax', type=float, default=120.0)
+    parser.add_argument('--out', default='fleet.csv')
+    args = parser.parse_args()
+
+    gainSets = list(itertools.product(parse_values(args.kp), parse_values(args.ki),
+                                      parse_values(args.kd), parse_values(args.kstanley)))
+    cars = args.cars or (500 if len(gainSets) == 1 else 1)
+    gains = np.repeat(np.array(gainSets), cars, axis=0)
+    n = len(gains)
+
+    waypoints, initialPose = load_path()
+    rng = np.random.default_rng(args.seed)
+    poses = np.tile(initialPose[:3], (n, 1))
+    poses[:, :2] += rng.normal(0.0, args.pose_noise, (n, 2))
+    poses[:, 2] += rng.normal(0.0, args.pose_noise/10, n)
+    plant = {name: value * (1 + rng.normal(0.0, args.plant_spread, n))
+             for name, value in [('motorGain', MOTOR_GAIN), ('motorTau', MOTOR_TAU),
+                                 ('wheelbase', WHEELBASE)]}
+
+    print("Simulating %d cars..." % n)
+    t0 = time.time()
+    results = simulate_fleet(gains, waypoints, poses, v_ref=args.v_ref,
+                             rate=args.rate, tmax=args.tmax, plant=plant)
+    elapsed = time.time() - t0
+    write_table(results, args.out)
+
+    done = [r for r in results if r['completed']]
+    ticks = (max(r['lap_time'] for r in done) if len(done) == n else args.tmax) * args.rate
+    print("Done in %.1f s (%.0f ticks/s for the whole fleet), %d/%d completed the lap"
+          % (elapsed, ticks / elapsed, len(done), n))
+    if done:
+        laps = np.array([r['lap_time'] for r in done])
+        xt = np.array([r['xt_max'] for r in done])
+        print("lap %.2f s mean, %.2f s p95; xt_max %.3f m mean, %.3f m p95"
+              % (laps.mean(), np.percentile(laps, 95), xt.mean(), np.percentile(xt, 95)))
@@ -0,0 +1,424 @@
+"""
+frame_bus.py
+
+One capture process, any number of local readers of the same RealSense
+frames.
+
+The capture process (python frame_bus.py) owns the camera and publishes
+every RGB and depth frame into a ring of preallocated slots in one
+shared-memory block, with a sequence number and timestamp per slot. Readers
+attach to the block by name and get NumPy views straight into the slots, so
+adding a reader costs no camera bandwidth. BusCamera does copy each frame
+out of its slot by default, as QCarRealSense does: one memcpy per frame
+per reader buys an image the writer can't overwrite mid-inference.
+copy=False gives the bare views.
+
+A view stays valid until the writer comes round the ring to its slot again,
+slots - 1 frames later; Frame.valid() tells whether that has happened. Each
+reader has an entry in a small table in the block with its pid, the last
+sequence number it took and how many frames it lost by falling behind, so
+the capture process can report slow readers, and a reader that took
+next() too late learns it from its dropped count. On POSIX, entries of
+readers that died without close() are freed for reuse.
+
+The header also holds the capture process's pid and a heartbeat updated
+with every frame. A second capture process refuses to start while they show
+the first one is alive, and only replaces a block left behind by one that
+died.
+
+    python frame_bus.py                 # start capturing
+    python frame_bus.py --watch         # attach and print frame rate and drops
+
+SDCS_Main.py and model_inference.py read from the bus with useFrameBus; the
+BusCamera class stands in for QCarRealSense.
+"""
+
+# region: package imports
+import argparse
+import os
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+#endregion
+
+BUS_NAME = 'qcar_frames'
+MAGIC = 0x51434652      # 'QCFR'
+HEADER = 10             # magic, slots, width, height, depthWidth, depthHeight, latest, maxReaders, writer pid, heartbeat (us)
+READER_FIELDS = 3       # pid, last sequence number taken, frames dropped
+ALIGN = 64
+
+
+def _aligned(n):
+    return -(-n // ALIGN) * ALIGN
+
+
+# Byte offsets of every array in the block
+def _layout(slots, width, height, depthWidth, depthHeight, maxReaders):
+    parts = [
+        ('header', np.int64, (HEADER,)),
+        ('readers', np.int64, (maxReaders, READER_FIELDS)),
+        ('seq', np.int64, (slots,)),
+        ('t', np.float64, (slots,)),
+        ('rgb', np.uint8, (slots, height, width, 3)),
+        ('depth', np.float32, (slots, depthHeight, depthWidth, 1)),
+    ]
+    layout = {}
+    offset = 0
+    for name, dtype, shape in parts:
+        layout[name] = (offset, dtype, shape)
+        offset += _aligned(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+    return layout, offset
+
+
+def _attach(name):
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    if os.name == 'posix':
+        # before 3.13 every process that opens the block would unlink it on exit
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+def _pid_dead(pid):
+    return os.name == 'posix' and pid > 0 and not _pid_alive(pid)
+
+
+def _pid_alive(pid):
+    # os.kill on Windows would terminate the process
+    if pid <= 0 or os.name != 'posix':
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Pid of the capture process publishing on the block name, or None if the
+# block was left behind (no heartbeat for staleAfter seconds and, on POSIX,
+# its writer is gone)
+def _live_writer(name, staleAfter):
+    try:
+        shm = _attach(name)
+    except FileNotFoundError:
+        return None
+    try:
+        if shm.size < HEADER * 8:
+            return None
+        header = np.ndarray((HEADER,), dtype=np.int64, buffer=shm.buf)
+        pid, beat = int(header[8]), int(header[9])
+        del header
+    finally:
+        shm.close()
+    if time.time() - beat / 1e6 < staleAfter or _pid_alive(pid):
+        return pid
+    return None
+
+
+class _Block:
+
+    def __init__(self, shm, slots, width, height, depthWidth, depthHeight, maxReaders):
+        self.shm = shm
+        self.slots = slots
+        layout, _ = _layout(slots, width, height, depthWidth, depthHeight, maxReaders)
+        for name, (offset, dtype, shape) in layout.items():
+            setattr(self, name, np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset))
+
+    def close(self):
+        for name in ('header', 'readers', 'seq', 't', 'rgb', 'depth'):
+            setattr(self, name, None)
+        try:
+            self.shm.close()
+        except BufferError:
+            # a caller still holds a frame view; the mapping goes with the process
+            pass
+
+
+class Frame:
+
+    def __init__(self, block, slot, seq):
+        self._block = block
+        self.slot = slot
+        self.seq = seq
+        self.t = float(block.t[slot])
+        self.rgb = block.rgb[slot]
+        self.depth = block.depth[slot]
+
+    # False once the writer has started reusing this frame's slot
+    def valid(self):
+        return self._block.seq[self.slot] == self.seq
+
+
+class FrameBus:
+
+    # Create the block; only the capture process does this
+    def __init__(self, name=BUS_NAME, width=640, height=480, depthWidth=640,
+                 depthHeight=480, slots=8, maxReaders=8, staleAfter=2.0):
+        _, size = _layout(slots, width, height, depthWidth, depthHeight, maxReaders)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            pid = _live_writer(name, staleAfter)
+            if pid is not None:
+                raise RuntimeError("Frame bus '%s' is already published by pid %d" % (name, pid))
+            # left behind by a capture process that didn't exit cleanly
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.block = _Block(shm, slots, width, height, depthWidth, depthHeight, maxReaders)
+        self.block.header[:] = [0, slots, width, height, depthWidth, depthHeight, 0, maxReaders,
+                                os.getpid(), int(time.time() * 1e6)]
+        self.block.readers[:] = 0
+        self.block.seq[:] = 0
+        self.block.header[0] = MAGIC
+        self.seq = 0
+
+    # Copy one frame into the next slot and make it the latest
+    def publish(self, rgb, depth=None, t=None):
+        b = self.block
+        self.seq += 1
+        slot = self.seq % b.slots
+        # readers holding the old frame of this slot see it go invalid first
+        b.seq[slot] = -1
+        np.copyto(b.rgb[slot], rgb)
+        if depth is not None:
+            np.copyto(b.depth[slot], depth.reshape(b.depth[slot].shape))
+        b.t[slot] = time.time() if t is None else t
+        b.seq[slot] = self.seq
+        b.header[6] = self.seq
+        b.header[9] = int(time.time() * 1e6)
+        return self.seq
+
+    # Readers whose next frame has already been overwritten: [(pid, behind)]
+    def slow_readers(self):
+        out = []
+        for entry in self.block.readers:
+            pid, last, _ = entry
+            if pid and _pid_dead(int(pid)):
+                entry[:] = 0
+            elif pid and self.seq - last >= self.block.slots:
+                out.append((int(pid), int(self.seq - last)))
+        return out
+
+    def close(self):
+        shm = self.block.shm
+        self.block.close()
+        shm.unlink()
+
+
+class FrameSubscriber:
+
+    def __init__(self, name=BUS_NAME, timeout=5.0):
+        deadline = time.time() + timeout
+        while True:
+            try:
+                shm = _attach(name)
+                break
+            except FileNotFoundError:
+                if time.time() > deadline:
+                    raise RuntimeError("No frame bus '%s'; start python frame_bus.py first" % name)
+                time.sleep(0.1)
+        header = np.ndarray((HEADER,), dtype=np.int64, buffer=shm.buf)
+        if header[0] != MAGIC:
+            raise RuntimeError("'%s' is not a frame bus" % name)
+        _, slots, width, height, depthWidth, depthHeight, _, maxReaders = (int(v) for v in header[:8])
+        del header
+        self.block = _Block(shm, slots, width, height, depthWidth, depthHeight, maxReaders)
+
+        # claim a free entry in the reader table, or one whose reader died
+        self.reader = None
+        for entry in self.block.readers:
+            if entry[0] == 0 or _pid_dead(int(entry[0])):
+                entry[:] = [os.getpid(), self.block.header[6], 0]
+                self.reader = entry
+                break
+        self.last = int(self.block.header[6])
+        self.dropped = 0
+
+    def _take(self, seq):
+        slot = seq % self.block.slots
+        if self.block.seq[slot] != seq:
+            return None
+        self.last = seq
+        if self.reader is not None:
+            self.reader[1] = seq
+            self.reader[2] = self.dropped
+        return Frame(self.block, slot, seq)
+
+    # Newest frame, whether or not it was returned before
+    def latest(self):
+        frame = None
+        while frame is None:
+            latest = int(self.block.header[6])
+            if latest == 0:
+                return None
+            frame = self._take(latest)
+        return frame
+
+    # The frame after the last one returned, waiting up to timeout seconds.
+    # skip: return the newest frame instead, without counting the ones in
+    # between as dropped (camera-like reads)
+    def next(self, timeout=None, skip=False):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            latest = int(self.block.header[6])
+            if latest > self.last:
+                if skip:
+                    frame = self._take(latest)
+                else:
+                    want = self.last + 1
+                    # the oldest frame still in the ring is latest - slots + 2,
+                    # the slot after it may already be being written
+                    oldest = latest - self.block.slots + 2
+                    if want < oldest:
+                        self.dropped += oldest - want
+                        want = oldest
+                    frame = self._take(want)
+                if frame is not None:
+                    return frame
+            if deadline is not None and time.time() > deadline:
+                return None
+            time.sleep(0.001)
+
+    def close(self):
+        if self.reader is not None:
+            self.reader[:] = 0
+            self.reader = None
+        self.block.close()
+
+
+# Stands in for QCarRealSense: read_RGB() waits for a frame newer than the
+# last one. Like QCarRealSense it copies it into imageBufferRGB, so the image
+# stays whole however long the detector takes over it; a copy the writer
+# overtook is thrown away and the newest frame copied instead. With
+# copy=False imageBufferRGB and imageBufferDepthM are views of the slot, and
+# valid() must be checked after using them. Both are None until the first
+# frame arrives; read_RGB() returns False if none came within timeout.
+class BusCamera:
+
+    def __init__(self, name=BUS_NAME, timeout=1.0, copy=True):
+        self.subscriber = FrameSubscriber(name)
+        self.timeout = timeout
+        self.copy = copy
+        self.frame = None
+        self.imageBufferRGB = None
+        self.imageBufferDepthM = None
+        self._rgb = None
+        self._depth = None
+
+    def read_RGB(self):
+        while True:
+            frame = self.subscriber.next(timeout=self.timeout, skip=True)
+            if frame is None:
+                return False
+            if not self.copy:
+                self.frame = frame
+                self.imageBufferRGB = frame.rgb
+                self.imageBufferDepthM = frame.depth
+                return True
+            if self._rgb is None:
+                self._rgb = np.empty_like(frame.rgb)
+                self._depth = np.empty_like(frame.depth)
+            np.copyto(self._rgb, frame.rgb)
+            if frame.valid():
+                self.frame = frame
+                self.imageBufferRGB = self._rgb
+                return True
+
+    # Depth of the frame read by the last read_RGB()
+    def read_depth(self, dataMode='M'):
+        if self.frame is None and not self.read_RGB():
+            return False
+        if not self.copy:
+            return True
+        while True:
+            np.copyto(self._depth, self.frame.depth)
+            if self.frame.valid():
+                self.imageBufferDepthM = self._depth
+                return True
+            # the slot was reused since read_RGB(): move both to a newer frame
+            if not self.read_RGB():
+                return False
+
+    # True while imageBufferRGB still holds the frame read last; always
+    # with copy
+    def valid(self):
+        return self.frame is not None and (self.copy or self.frame.valid())
+
+    def terminate(self):
+        self.frame = None
+        self.imageBufferRGB = None
+        self.imageBufferDepthM = None
+        self.subscriber.close()
+
+
+def capture(name=BUS_NAME, width=640, height=480, slots=8, reportPeriod=2.0):
+    from pal.products.qcar import QCarRealSense
+
+    camera = QCarRealSense(mode='RGB&DEPTH',
+                           frameWidthRGB=width, frameHeightRGB=height,
+                           frameWidthDepth=width, frameHeightDepth=height)
+    bus = FrameBus(name, width, height, width, height, slots=slots)
+    print("Publishing %dx%d RGB and depth on '%s'" % (width, height, name))
+    tReport = time.time()
+    count = 0
+    try:
+        while True:
+            camera.read_RGB()
+            camera.read_depth(dataMode='M')
+            bus.publish(camera.imageBufferRGB, camera.imageBufferDepthM)
+            count += 1
+            now = time.time()
+            if now - tReport >= reportPeriod:
+                slow = ', '.join('pid %d %d behind' % s for s in bus.slow_readers())
+                print("%.1f fps%s" % (count / (now - tReport), '; slow: ' + slow if slow else ''))
+                tReport = now
+                count = 0
+    except KeyboardInterrupt:
+        pass
+    finally:
+        camera.terminate()
+        bus.close()
+
+
+def watch(name=BUS_NAME, reportPeriod=2.0):
+    subscriber = FrameSubscriber(name)
+    tReport = time.time()
+    count = 0
+    try:
+        while True:
+            if subscriber.next(timeout=1.0) is not None:
+                count += 1
+            now = time.time()
+            if now - tReport >= reportPeriod:
+                print("%.1f fps, %d dropped, latest #%d" % (
+                    count / (now - tReport), subscriber.dropped, subscriber.last))
+                tReport = now
+                count = 0
+    except KeyboardInterrupt:
+        pass
+    finally:
+        subscriber.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Shared-memory camera frame bus')
+    parser.add_argument('--name', default=BUS_NAME)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--slots', type=int, default=8)
+    parser.add_argument('--watch', action='store_true', help='attach as a reader and report')
+    args = parser.parse_args()
+
+    if args.watch:
+        watch(args.name)
+    else:
+        capture(args.name, args.width, args.height, args.slots)
@@ -0,0 +1,104 @@
+"""
+frame_gate.py
+
+Skips detector runs on frames that are nearly identical to the last one the
+detector saw (car held at a stop, creeping slowly). Each frame is shrunk to a
+small colour thumbnail; if no thumbnail cell differs from the reference by
+more than threshold grey levels, the previous result is reused. The largest
+cell difference is used rather than the mean so a small change such as a
+traffic light switching colour is still caught. A result is never reused
+for longer than maxStale seconds.
+
+The reference is the thumbnail of the last frame that was actually run, so
+a slow drift still triggers a new inference once it adds up.
+
+The per-lap counters are guarded by a lock: run() counts on the perception
+thread while new_lap() is called from controlLoop's lap callback.
+"""
+
+# region: package imports
+import time
+from threading import Lock
+
+import cv2
+import numpy as np
+
+#endregion
+
+
+class FrameGate:
+
+    # clock: anything with a time() method (see clock.py); wall time if None
+    def __init__(self, thumbSize=(64, 48), threshold=10, maxStale=0.5, clock=None):
+        self.thumbSize = thumbSize
+        self.threshold = threshold
+        self.maxStale = maxStale
+        self._time = time.time if clock is None else clock.time
+
+        w, h = thumbSize
+        self._thumb = np.empty((h, w, 3), dtype=np.uint8)
+        self._ref = np.empty((h, w, 3), dtype=np.uint8)
+        self._diff = np.empty((h, w, 3), dtype=np.uint8)
+        self._hasRef = False
+        self._result = None
+        self._tResult = 0.0
+        # True if the last run() ran the detector
+        self.fresh = False
+
+        # counters for the current lap, and one entry per finished lap
+        self.inferences = 0
+        self.saved = 0
+        self.laps = []
+        self._lock = Lock()
+
+    # Largest per-cell difference between frame and the reference thumbnail
+    def score(self, frame):
+        cv2.resize(frame, self.thumbSize, dst=self._thumb, interpolation=cv2.INTER_AREA)
+        if not self._hasRef:
+            return float('inf')
+        cv2.absdiff(self._thumb, self._ref, dst=self._diff)
+        return float(self._diff.max())
+
+    # Run detect(frame) if the scene has changed or the last result is too
+    # old, otherwise return the last result
+    def run(self, frame, detect):
+        now = self._time()
+        if self.score(frame) <= self.threshold and now - self._tResult < self.maxStale:
+            with self._lock:
+                self.saved += 1
+            self.fresh = False
+            return self._result
+
+        self._result = detect(frame)
+        self.fresh = True
+        self._tResult = now
+        self._ref[...] = self._thumb
+        self._hasRef = True
+        with self._lock:
+            self.inferences += 1
+        return self._result
+
+    # Close the counters of the current lap and return them
+    def new_lap(self):
+        with self._lock:
+            lap = {'inferences': self.inferences, 'saved': self.saved}
+            self.laps.append(lap)
+            self.inferences = 0
+            self.saved = 0
+        return lap
+
+    # Frames reused over the whole run, then per finished lap
+    def report(self):
+        with self._lock:
+            laps = list(self.laps)
+            saved = self.saved + sum(lap['saved'] for lap in laps)
+            inferences = self.inferences + sum(lap['inferences'] for lap in laps)
+        lines = [_reused(saved, inferences)]
+        for i, lap in enumerate(laps):
+            lines.append("    lap %d: %s" % (i + 1, _reused(lap['saved'], lap['inferences'])))
+        return '\n'.join(lines)
+
+
+def _reused(saved, inferences):
+    total = saved + inferences
+    return "%d/%d frames reused (%.0f%%)" % (saved, total, 100.0*saved/total if total else 0.0)
@@ -0,0 +1,117 @@
+"""
+frame_ingest.py
+
+Preallocated frame path from the camera into the detector.
+
+Passing a NumPy frame to ultralytics costs a copy, a letterbox, a transpose,
+a float conversion and a new tensor on every call. FrameIngest does the same
+preprocessing into buffers that are allocated once and reused: the frame is
+resized (only if needed) and padded into a fixed uint8 canvas, then converted
+BGR->RGB, HWC->CHW and scaled to 0..1 straight into a float tensor that the
+model accepts as is. On CUDA the host tensor is pinned and copied into a
+preallocated device tensor without blocking.
+
+The detector then reports boxes in canvas coordinates; to_frame() maps them
+back onto the camera frame, where crops are plain slices (views). hsv() and
+mask() convert crops into reused scratch buffers for the colour logic.
+"""
+
+# region: package imports
+import cv2
+import numpy as np
+import torch
+
+#endregion
+
+STRIDE = 32
+
+
+class FrameIngest:
+
+    # square: pad to imgsz x imgsz instead of the smallest stride multiple, so
+    # frames of different sizes can share one batch.
+    # host: optional (1, 3, H, W) float tensor to write into, e.g. one slot of
+    # a batch tensor; the caller then owns the device copy.
+    def __init__(self, frameWidth=640, frameHeight=480, imgsz=640,
+                 device=None, padValue=114, square=False, host=None):
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.device = torch.device(device)
+
+        # Scale the longest side to imgsz and pad up to the next stride
+        # multiple, the same geometry ultralytics' letterbox uses
+        self.scale = min(imgsz / frameWidth, imgsz / frameHeight)
+        w = int(round(frameWidth * self.scale))
+        h = int(round(frameHeight * self.scale))
+        if square:
+            W = H = int(np.ceil(imgsz / STRIDE) * STRIDE)
+        else:
+            W = int(np.ceil(w / STRIDE) * STRIDE)
+            H = int(np.ceil(h / STRIDE) * STRIDE)
+        self.padX = (W - w) // 2
+        self.padY = (H - h) // 2
+        self.frameShape = (frameHeight, frameWidth)
+        self.resizedShape = (h, w)
+
+        self.canvas = np.full((H, W, 3), padValue, dtype=np.uint8)
+        self._inner = self.canvas[self.padY:self.padY + h, self.padX:self.padX + w]
+        if (h, w) != self.frameShape:
+            self._resized = np.empty((h, w, 3), dtype=np.uint8)
+        else:
+            self._resized = None
+
+        pin = self.device.type == 'cuda' and host is None
+        if host is None:
+            host = torch.empty((1, 3, H, W), dtype=torch.float32, pin_memory=pin)
+        self.host = host
+        self._hostArray = self.host.numpy()[0]
+        if pin:
+            self.tensor = torch.empty((1, 3, H, W), dtype=torch.float32, device=self.device)
+        else:
+            self.tensor = self.host
+
+        # Scratch space for crops, sized for the whole frame
+        self._hsvFlat = np.empty(frameHeight * frameWidth * 3, dtype=np.uint8)
+        self._maskFlat = {}
+
+    # Fill the input tensor from a BGR camera frame and return it
+    def prepare(self, frame):
+        if self._resized is not None:
+            cv2.resize(frame, (self._resized.shape[1], self._resized.shape[0]),
+                       dst=self._resized, interpolation=cv2.INTER_LINEAR)
+            frame = self._resized
+        self._inner[...] = frame
+
+        # BGR HWC uint8 -> RGB CHW float 0..1, written in place
+        np.multiply(self.canvas.transpose(2, 0, 1)[::-1], np.float32(1.0 / 255.0),
+                    out=self._hostArray)
+
+        if self.tensor is not self.host:
+            self.tensor.copy_(self.host, non_blocking=True)
+        return self.tensor
+
+    # Map a box from canvas to camera-frame pixel coordinates
+    def to_frame(self, xyxy):
+        x1, y1, x2, y2 = (float(v) for v in xyxy)
+        h, w = self.frameShape
+        x1 = min(max((x1 - self.padX) / self.scale, 0), w)
+        x2 = min(max((x2 - self.padX) / self.scale, 0), w)
+        y1 = min(max((y1 - self.padY) / self.scale, 0), h)
+        y2 = min(max((y2 - self.padY) / self.scale, 0), h)
+        return int(x1), int(y1), int(x2), int(y2)
+
+    # HSV copy of a BGR crop, written into a reused buffer
+    def hsv(self, crop):
+        h, w = crop.shape[:2]
+        out = self._hsvFlat[:h * w * 3].reshape(h, w, 3)
+        return cv2.cvtColor(crop, cv2.COLOR_BGR2HSV, dst=out)
+
+    # cv2.inRange into a reused buffer; one buffer per key so several masks
+    # of the same crop can be alive at once
+    def mask(self, hsvImage, lower, upper, key=0):
+        h, w = hsvImage.shape[:2]
+        flat = self._maskFlat.get(key)
+        if flat is None:
+            flat = self._maskFlat[key] = np.empty(self._hsvFlat.size // 3, dtype=np.uint8)
+        out = flat[:h * w].reshape(h, w)
+        return cv2.inRange(hsvImage, lower, upper, dst=out)
@@ -0,0 +1,201 @@
+"""
+gain_sweep.py
+
+Headless tuning of K_p, K_i, K_d and K_stanley. Each gain set drives
+SpeedController and SteeringController around the real waypointSequence
+against a kinematic bicycle model of the QCar, with no simulator, camera or
+scopes, as fast as the CPU allows. Gain sets are spread over all cores with a
+process pool and the results are written to a CSV table.
+
+    python gain_sweep.py --kp 0.2:0.8:4 --ki 0.3:0.9:4 --kd 0.6:1.8:4 --kstanley 0.5,1,2
+    python gain_sweep.py --mode random --samples 5000 --out sweep.csv
+"""
+
+# region: package imports
+import argparse
+import csv
+import itertools
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from controllers import SpeedController, SteeringController
+
+#endregion
+
+# Defaults mirror SDCS_Main
+V_REF = 0.65
+NODE_SEQUENCE = [10, 2, 4, 20, 22, 10]
+CONTROLLER_RATE = 500
+
+# QCar plant approximation
+WHEELBASE = 0.256       # m
+MOTOR_GAIN = 5.0        # steady state speed per unit throttle [m/s]
+MOTOR_TAU = 0.25        # motor/drivetrain time constant [s]
+LOOKAHEAD = 0.2         # controlLoop steers from a point 0.2 m ahead
+
+FIELDS = ['kp', 'ki', 'kd', 'k_stanley', 'lap_time', 'xt_rms', 'xt_max',
+          'overshoot', 'effort', 'completed']
+
+
+class KinematicBicycle:
+
+    def __init__(self, pose, wheelbase=WHEELBASE, motorGain=MOTOR_GAIN,
+                 motorTau=MOTOR_TAU, maxSteeringAngle=np.pi/6):
+        self.x, self.y, self.th = float(pose[0]), float(pose[1]), float(pose[2])
+        self.v = 0.0
+
+        self.wheelbase = wheelbase
+        self.motorGain = motorGain
+        self.motorTau = motorTau
+        self.maxSteeringAngle = maxSteeringAngle
+
+    def step(self, u, delta, dt):
+        delta = np.clip(delta, -self.maxSteeringAngle, self.maxSteeringAngle)
+        self.v += dt * (self.motorGain*u - self.v) / self.motorTau
+        self.x += dt * self.v * np.cos(self.th)
+        self.y += dt * self.v * np.sin(self.th)
+        self.th += dt * self.v / self.wheelbase * np.tan(delta)
+
+
+# Drive one lap with the given gains and return its metrics
+def simulate(gains, waypoints, initialPose, v_ref=V_REF,
+             rate=CONTROLLER_RATE, tmax=120.0):
+    kp, ki, kd, k_stanley = gains
+    speedController = SpeedController(kp=kp, ki=ki, kd=kd)
+    steeringController = SteeringController(
+        waypoints=waypoints, k=k_stanley, cyclic=False)
+    car = KinematicBicycle(initialPose)
+
+    dt = 1.0 / rate
+    t = 0.0
+    steps = 0
+    xt_sq = 0.0
+    xt_max = 0.0
+    v_max = 0.0
+    effort = 0.0
+    completed = False
+    end = steeringController.N - 2
+
+    while t < tmax:
+        p = np.array([car.x + LOOKAHEAD*np.cos(car.th),
+                      car.y + LOOKAHEAD*np.sin(car.th)])
+        u = speedController.update(car.v, v_ref, dt)
+        delta = steeringController.update(p, car.th, car.v)
+        car.step(u, delta, dt)
+        t += dt
+        steps += 1
+
+        xt = np.hypot(*(p - steeringController.p_ref))
+        xt_sq += xt*xt
+        xt_max = max(xt_max, xt)
+        v_max = max(v_max, car.v)
+        effort += abs(u)
+
+        if steeringController.wpi >= end:
+            completed = True
+            break
+
+    return {
+        'kp': kp, 'ki': ki, 'kd': kd, 'k_stanley': k_stanley,
+        'lap_time': round(t, 3) if completed else float('nan'),
+        'xt_rms': np.sqrt(xt_sq / steps),
+        'xt_max': xt_max,
+        'overshoot': max(0.0, v_max - v_ref) / v_ref,
+        'effort': effort / steps,
+        'completed': completed,
+    }
+
+
+# Worker state, set once per process so the waypoints aren't pickled per task
+_waypoints = None
+_initialPose = None
+_options = {}
+
+
+def _init_worker(waypoints, initialPose, options):
+    global _waypoints, _initialPose, _options
+    _waypoints = waypoints
+    _initialPose = initialPose
+    _options = options
+
+
+def _run(gains):
+    return simulate(gains, _waypoints, _initialPose, **_options)
+
+
+def load_path(nodeSequence=NODE_SEQUENCE):
+    from hal.products.mats import SDCSRoadMap
+    roadmap = SDCSRoadMap(leftHandTraffic=False)
+    waypoints = roadmap.generate_path(nodeSequence)
+    initialPose = roadmap.get_node_pose(nodeSequence[0]).squeeze()
+    return waypoints, initialPose
+
+
+# "a,b,c" is a list of values, "start:stop:num" is a linspace
+def parse_values(text):
+    if ':' in text:
+        start, stop, num = text.split(':')
+        return list(np.linspace(float(start), float(stop), int(num)))
+    return [float(v) for v in text.split(',')]
+
+
+def gain_sets(args):
+    axes = [parse_values(args.kp), parse_values(args.ki),
+            parse_values(args.kd), parse_values(args.kstanley)]
+    if args.mode == 'grid':
+        return list(itertools.product(*axes))
+    rng = random.Random(args.seed)
+    return [tuple(rng.uniform(min(a), max(a)) for a in axes)
+            for _ in range(args.samples)]
+
+
+def sweep(gainSets, waypoints, initialPose, workers=None, **options):
+    workers = workers or os.cpu_count()
+    chunksize = max(1, len(gainSets) // (workers*8))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(waypoints, initialPose, options)) as pool:
+        return list(pool.map(_run, gainSets, chunksize=chunksize))
+
+
+def write_table(results, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        for r in results:
+            writer.writerow(r)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless controller gain sweep')
+    parser.add_argument('--kp', default='0.2:0.8:5')
+    parser.add_argument('--ki', default='0.3:0.9:5')
+    parser.add_argument('--kd', default='0.4:1.6:4')
+    parser.add_argument('--kstanley', default='0.5,1,1.5,2')
+    parser.add_argument('--mode', choices=['grid', 'random'], default='grid')
+    parser.add_argument('--samples', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--v-ref', type=float, default=V_REF)
+    parser.add_argument('--rate', type=float, default=CONTROLLER_RATE)
+    parser.add_argument('--tmax', type=float, default=120.0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', default='gain_sweep.csv')
+    args = parser.parse_args()
+
+    waypoints, initialPose = load_path()
+    gainSets = gain_sets(args)
+    print("Sweeping %d gain sets..." % len(gainSets))
+
+    t0 = time.time()
+    results = sweep(gainSets, waypoints, initialPose, workers=args.workers,
+                    v_ref=args.v_ref, rate=args.rate, tmax=args.tmax)
+    write_table(results, args.out)
+
+    done = [r for r in results if r['completed']]
+    print("Done in %.1f s, %d/%d completed the lap" % (time.time()-t0, len(done), len(results)))
+    for r in sorted(done, key=lambda r: (r['lap_time'], r['xt_rms']))[:5]:
+        print("kp=%.3f ki=%.3f kd=%.3f k_stanley=%.3f  lap %.2f s  xt_rms %.3f m"
+              % (r['kp'], r['ki'], r['kd'], r['k_stanley'], r['lap_time'], r['xt_rms']))
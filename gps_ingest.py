@@ -0,0 +1,105 @@
+"""
+gps_ingest.py
+
+GPS fixes read off the control loop's hot path.
+
+QCarGPS.readGPS() only returns True when a new fix has arrived, which is a
+small fraction of controlLoop's 500 Hz ticks. GPSIngest polls it on a thread
+of its own at pollPeriod, a few times the fix rate rather than the control
+rate, and publishes each fix in a latest-value slot. The slot is a single
+tuple that is replaced whole, so controlLoop reads it without a lock and
+take() only returns a fix it has not seen before. Given a ThreadBudget, the
+thread pins itself to the 'gps' role so it doesn't share the control core.
+
+QCarGPS gives no measurement time, so a fix is stamped with the time it was
+read less the configured sensor latency and half a poll period (the mean
+wait for the poll). compensate() rolls it forward from that time with the
+bicycle model before it is used as a measurement.
+"""
+
+# region: package imports
+import math
+from threading import Thread
+
+import numpy as np
+
+#endregion
+
+WHEELBASE = 0.256       # m
+
+
+class GPSIngest:
+
+    # clock: the run's clock (see clock.py); pollPeriod: seconds between reads
+    # latency: seconds from measurement to the fix being readable
+    # budget: ThreadBudget to pin the ingest thread with, if any
+    def __init__(self, gps, clock, pollPeriod=0.02, latency=0.0, budget=None):
+        self.gps = gps
+        self.clock = clock
+        self.pollPeriod = pollPeriod
+        self.latency = latency
+        self.budget = budget
+        # (sequence number, measurement time, [x, y, th])
+        self._slot = (0, clock.time(), np.array([
+            gps.position[0], gps.position[1], gps.orientation[2]]))
+        self._taken = 0
+        self._stop = False
+        self._thread = Thread(target=self._run, daemon=True)
+
+    # Call inside the gps context, from the thread that will consume fixes
+    def start(self):
+        # registered here so a virtual clock can't tick past the first poll
+        self.clock.register()
+        self._thread.start()
+        return self
+
+    # Call after the driving thread has stopped ticking (clock.release())
+    def stop(self):
+        self._stop = True
+        # start() may not have got that far
+        if self._thread.ident is not None:
+            self._thread.join()
+
+    def _run(self):
+        if self.budget is not None:
+            self.budget.pin('gps')
+        age = self.latency + 0.5 * self.pollPeriod
+        try:
+            while not self._stop:
+                if self.gps.readGPS():
+                    seq = self._slot[0] + 1
+                    self._slot = (seq, self.clock.time() - age, np.array([
+                        self.gps.position[0],
+                        self.gps.position[1],
+                        self.gps.orientation[2]
+                    ]))
+                self.clock.sleep(self.pollPeriod)
+        finally:
+            self.clock.unregister()
+
+    # Most recent fix as (measurement time, [x, y, th]), new or not
+    def latest(self):
+        _, t, y = self._slot
+        return t, y
+
+    # (measurement time, [x, y, th]) of a fix not returned before, else None
+    def take(self):
+        seq, t, y = self._slot
+        if seq == self._taken:
+            return None
+        self._taken = seq
+        return t, y
+
+    # Roll a fix taken at tFix forward to time t at speed v and steering delta
+    @staticmethod
+    def compensate(fix, t, v, delta, wheelbase=WHEELBASE):
+        tFix, y = fix
+        age = t - tFix
+        if age <= 0:
+            return y
+        th = y[2] + 0.5 * age * v / wheelbase * math.tan(delta)
+        return np.array([
+            y[0] + age * v * math.cos(th),
+            y[1] + age * v * math.sin(th),
+            (y[2] + age * v / wheelbase * math.tan(delta) + math.pi) % (2*math.pi) - math.pi
+        ])
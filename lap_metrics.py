@@ -0,0 +1,171 @@
+"""
+lap_metrics.py
+
+Lap timing and per-segment splits from SteeringController progress.
+
+SteeringController.wpi only ever increases on a cyclic path, so a lap is
+finished when wpi is N-1 past the start of the lap. Segment boundaries are
+the waypoints closest to the roadmap nodes of nodeSequence, and a split is
+recorded as wpi passes each one. A route hand-off
+(route_table.RouteHandOff) restarts wpi at 0 and calls route_changed().
+Every tick also accumulates cross-track error, and every hold at v_ref = 0
+is recorded as a stop with the segment it happened in. A hold that spans
+the end of a lap is split between the two laps.
+
+update() is called from controlLoop at the full control rate, so it only does
+scalar arithmetic; report() and save() produce the per-run summary.
+"""
+
+# region: package imports
+import json
+import math
+
+import numpy as np
+
+#endregion
+
+
+# Waypoint index closest to each node position, searched in order so a node
+# visited twice gets its own index each time. The path starts at the first
+# node and ends at the last one.
+def split_indices(waypoints, nodePositions):
+    n = waypoints.shape[1]
+    indices = [0]
+    for pos in nodePositions[1:-1]:
+        start = indices[-1] + 1
+        d = np.hypot(waypoints[0, start:] - pos[0], waypoints[1, start:] - pos[1])
+        indices.append(start + int(np.argmin(d)))
+    indices.append(n - 1)
+    return indices
+
+
+class LapMetrics:
+
+    # splits: waypoint indices of the segment boundaries (see split_indices)
+    # names: label of each boundary, e.g. the roadmap node numbers
+    # onLap: optional callback, called with each finished lap's summary
+    def __init__(self, waypoints, splits, names=None, onLap=None):
+        self.lapLength = len(waypoints[0, :]) - 1
+        self.splits = list(splits)
+        self.names = list(names) if names is not None else list(range(len(splits)))
+        self.onLap = onLap
+
+        self.laps = []
+        # wpi at the start of the current lap
+        self._lapOrigin = 0
+        self._start_lap(None)
+
+    # The controller was handed a new route; the lap in progress is dropped
+    # and timing starts over on the new route, with splits at its ends
+    # unless given
+    def route_changed(self, waypoints, splits=None, names=None):
+        self.lapLength = len(waypoints[0, :]) - 1
+        self.splits = list(splits) if splits is not None else [0, self.lapLength]
+        self.names = list(names) if names is not None else list(range(len(self.splits)))
+        self._lapOrigin = 0
+        stop = self._stopStart
+        self._start_lap(None)
+        if stop is not None:
+            self._stopStart = (stop[0], 0)
+
+    def _start_lap(self, t):
+        self.lapStart = t
+        self.lapIndex = len(self.laps)
+        self.nextSplit = 1
+        self.splitTimes = []
+        self.stops = []
+        self._stopStart = None
+        self._xtSq = 0.0
+        self._xtMax = 0.0
+        self._ticks = 0
+
+    def segment(self, wpi):
+        i = wpi - self._lapOrigin
+        for k in range(1, len(self.splits)):
+            if i < self.splits[k]:
+                return '%s-%s' % (self.names[k-1], self.names[k])
+        return '%s-%s' % (self.names[-2], self.names[-1])
+
+    def update(self, t, wpi, v_ref, p, p_ref):
+        if self.lapStart is None:
+            self.lapStart = t
+
+        xt = math.hypot(p[0] - p_ref[0], p[1] - p_ref[1])
+        self._xtSq += xt*xt
+        if xt > self._xtMax:
+            self._xtMax = xt
+        self._ticks += 1
+
+        # holds at a stop sign / red light
+        if v_ref == 0 and self._stopStart is None:
+            self._stopStart = (t, wpi)
+        elif v_ref != 0 and self._stopStart is not None:
+            self._close_stop(t)
+
+        i = wpi - self._lapOrigin
+        while self.nextSplit < len(self.splits) and i >= self.splits[self.nextSplit]:
+            k = self.nextSplit
+            self.splitTimes.append({'segment': '%s-%s' % (self.names[k-1], self.names[k]),
+                                    'time': round(t - self.lapStart, 3)})
+            self.nextSplit += 1
+
+        if i >= self.lapLength:
+            self._finish_lap(t, wpi)
+
+    def _close_stop(self, t):
+        t1, w1 = self._stopStart
+        self.stops.append({'segment': self.segment(w1), 'wpi': w1 % self.lapLength,
+                           'start': round(t1 - self.lapStart, 3),
+                           'duration': round(t - t1, 3)})
+        self._stopStart = None
+
+    def _finish_lap(self, t, wpi):
+        # a hold still going on counts up to here and carries on next lap
+        stopped = self._stopStart is not None
+        if stopped:
+            self._close_stop(t)
+        lap = {
+            'lap': self.lapIndex + 1,
+            'lap_time': round(t - self.lapStart, 3),
+            'splits': self._segment_times(),
+            'stops': self.stops,
+            'stopped_time': round(sum(s['duration'] for s in self.stops), 3),
+            'xt_rms': math.sqrt(self._xtSq / self._ticks) if self._ticks else 0.0,
+            'xt_max': self._xtMax,
+        }
+        self.laps.append(lap)
+        if self.onLap is not None:
+            self.onLap(lap)
+        self._lapOrigin += self.lapLength
+        self._start_lap(t)
+        if stopped:
+            self._stopStart = (t, wpi)
+
+    # Time spent in each segment from the cumulative split times
+    def _segment_times(self):
+        out = []
+        prev = 0.0
+        for s in self.splitTimes:
+            out.append({'segment': s['segment'], 'time': round(s['time'] - prev, 3)})
+            prev = s['time']
+        return out
+
+    def report(self):
+        lines = []
+        for lap in self.laps:
+            lines.append("Lap %d: %.2f s (stopped %.2f s), xt rms %.3f m, max %.3f m" % (
+                lap['lap'], lap['lap_time'], lap['stopped_time'], lap['xt_rms'], lap['xt_max']))
+            for s in lap['splits']:
+                lines.append("    %-8s %6.2f s" % (s['segment'], s['time']))
+            for s in lap['stops']:
+                lines.append("    stop in %s at %.2f s for %.2f s" % (s['segment'], s['start'], s['duration']))
+        if self.laps:
+            times = [lap['lap_time'] for lap in self.laps]
+            lines.append("%d laps, best %.2f s, mean %.2f s" % (len(times), min(times), sum(times)/len(times)))
+        else:
+            lines.append("No complete laps")
+        return '\n'.join(lines)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'nodes': self.names, 'splits': self.splits, 'laps': self.laps}, f, indent=2)
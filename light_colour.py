@@ -0,0 +1,67 @@
+"""
+light_colour.py
+
+Traffic light colour from a crop of the light, by comparing how bright the
+lit and unlit green and red lamp colours are in it. Moved out of SDCS_Main
+so perception_eval.py can sweep the HSV windows with the same code.
+
+hueWindow and satValWindow are the half widths of each colour's HSV window:
+hue +-hueWindow, saturation and value +-satValWindow (never below 100).
+"""
+
+# region: package imports
+import cv2
+import numpy as np
+
+#endregion
+
+
+# Convert HEX to RGB
+def hex_to_rgb(hex_color):
+    hex_color = hex_color.lstrip('#')
+    lv = len(hex_color)
+    return tuple(int(hex_color[i:i + lv // 3], 16) for i in range(0, lv, lv // 3))
+
+# Convert RGB to HSV
+def rgb_to_hsv(r, g, b):
+    color = np.uint8([[[b, g, r]]])
+    hsv_color = cv2.cvtColor(color, cv2.COLOR_BGR2HSV)
+    return hsv_color[0][0]
+
+# Calculate brightness
+def calculate_brightness(mask):
+    return np.sum(mask) / np.count_nonzero(mask) if np.count_nonzero(mask) else 0
+
+# Define the color ranges in HSV space
+green_on_hsv = rgb_to_hsv(*hex_to_rgb("#78F569"))
+green_off_hsv = rgb_to_hsv(*hex_to_rgb("#20712F"))
+red_on_hsv = rgb_to_hsv(*hex_to_rgb("#FB6B51"))
+red_off_hsv = rgb_to_hsv(*hex_to_rgb("#79414E"))
+
+LAMPS = {
+    'green_on': green_on_hsv,
+    'green_off': green_off_hsv,
+    'red_on': red_on_hsv,
+    'red_off': red_off_hsv,
+}
+
+
+# Lower and upper inRange bounds of the window around color_hsv
+def mask_bounds(color_hsv, hueWindow=10, satValWindow=40):
+    lower_bound = np.array([color_hsv[0] - hueWindow, max(color_hsv[1] - satValWindow, 100), max(color_hsv[2] - satValWindow, 100)])
+    upper_bound = np.array([color_hsv[0] + hueWindow, min(color_hsv[1] + satValWindow, 255), min(color_hsv[2] + satValWindow, 255)])
+    return lower_bound, upper_bound
+
+
+def _in_range(hsv_image, lower, upper, key=None):
+    return cv2.inRange(hsv_image, lower, upper)
+
+
+# 'green' or 'red' for an HSV crop of a light. mask(hsv_image, lower, upper,
+# key) makes the masks, e.g. FrameIngest.mask to reuse buffers.
+def classify_light(hsv_image, hueWindow=10, satValWindow=40, mask=_in_range):
+    brightness = {}
+    for name, color_hsv in LAMPS.items():
+        lower, upper = mask_bounds(color_hsv, hueWindow, satValWindow)
+        brightness[name] = calculate_brightness(mask(hsv_image, lower, upper, name))
+    return 'green' if brightness['green_on'] > brightness['green_off'] else 'red'
@@ -0,0 +1,232 @@
+"""
+light_phase.py
+
+Learns the cycle of each traffic light from the colour decisions of
+process_images and slows the car ahead of time so it reaches the light just
+after it turns green, instead of stopping at it.
+
+PhaseEstimator watches one light. A colour change seen while the light stays
+in view (no gap longer than maxGap between decisions, and confirm decisions
+in a row so a single misread doesn't count) gives a transition time, halfway
+between the last decision of the old colour and the first of the new one.
+Two transitions in one sighting give a phase duration; the cycle is the sum
+of the median green and red durations, refined from the spacing of green
+onsets seen on different laps, which may be several cycles apart. The model
+is published as one (cycle, green, greenOnset) tuple so the control thread
+reads it without a lock.
+
+LightPhaseAdvisor knows where each light is along waypointSequence. Every
+control tick it finds the light ahead and, within adviseRange, predicts its
+colour at the time the car would arrive at v_ref. If that is red it returns
+the speed that arrives greenMargin seconds after the next green onset, unless
+that would be slower than minSpeed, in which case the car stops as before.
+
+The advice is only trusted while the camera agrees with the model. If the
+light ahead is seen in the other colour than predicted (confirm decisions in
+a row, away from a predicted transition), or perception has to stop for it
+anyway (distrust()), the advisor gives no more advice for that light until
+the car has passed it, and the car stops for it as before.
+"""
+
+# region: package imports
+import math
+from collections import deque
+
+import numpy as np
+
+#endregion
+
+
+class PhaseEstimator:
+
+    def __init__(self, confirm=3, maxGap=1.0, history=8):
+        self.confirm = confirm
+        self.maxGap = maxGap
+
+        self.durations = {'green': deque(maxlen=history), 'red': deque(maxlen=history)}
+        self.greenOnsets = deque(maxlen=history)
+        self.model = None
+
+        self._state = None          # confirmed colour of the current sighting
+        self._lastSeen = -math.inf  # time of the last decision of _state
+        self._phaseStart = None     # transition into _state, if seen
+        self._candidate = None
+        self._candidateFirst = 0.0
+        self._candidateCount = 0
+        self._lastT = -math.inf
+
+    def observe(self, colour, t):
+        if colour not in ('green', 'red'):
+            return
+        if t - self._lastT > self.maxGap:
+            # lost sight of the light: what follows is a new sighting
+            self._state = None
+            self._phaseStart = None
+            self._candidate = None
+        self._lastT = t
+
+        if self._state is None:
+            self._state = colour
+            self._lastSeen = t
+            return
+        if colour == self._state:
+            self._lastSeen = t
+            self._candidate = None
+            return
+
+        if colour != self._candidate:
+            self._candidate = colour
+            self._candidateFirst = t
+            self._candidateCount = 0
+        self._candidateCount += 1
+        if self._candidateCount < self.confirm:
+            return
+
+        transition = 0.5 * (self._lastSeen + self._candidateFirst)
+        if self._phaseStart is not None:
+            self.durations[self._state].append(transition - self._phaseStart)
+        if colour == 'green':
+            self.greenOnsets.append(transition)
+        self._state = colour
+        self._lastSeen = t
+        self._phaseStart = transition
+        self._candidate = None
+        self._estimate()
+
+    def _estimate(self):
+        if not self.durations['green'] or not self.durations['red'] or not self.greenOnsets:
+            return
+        green = float(np.median(self.durations['green']))
+        red = float(np.median(self.durations['red']))
+        cycle = green + red
+        # green onsets laps apart pin the cycle down far better than one phase
+        baseline = self.greenOnsets[-1] - self.greenOnsets[0]
+        cycles = round(baseline / cycle)
+        if cycles >= 1:
+            cycle = baseline / cycles
+        self.model = (cycle, cycle * green / (green + red), self.greenOnsets[-1])
+
+
+# Colour of a light with model (cycle, green, greenOnset) at time t and the
+# time its next green phase starts
+def predict(model, t):
+    cycle, green, onset = model
+    phase = (t - onset) % cycle
+    return ('green' if phase < green else 'red'), t + cycle - phase
+
+
+class LightPhaseAdvisor:
+
+    # lights: {name: (x, y)} light positions; each light's stop point is the
+    # closest waypoint to it, less stopMargin metres
+    # clock: the run's clock (see clock.py)
+    def __init__(self, waypoints, lights, clock, stopMargin=0.3, adviseRange=3.0,
+                 observeRange=5.0, minSpeed=0.2, greenMargin=0.3, **estimatorArgs):
+        self.clock = clock
+        self.stopMargin = stopMargin
+        self.adviseRange = adviseRange
+        self.observeRange = observeRange
+        self.minSpeed = minSpeed
+        self.greenMargin = greenMargin
+        self.lights = dict(lights)
+        self.estimators = {name: PhaseEstimator(**estimatorArgs) for name in lights}
+        self._set_route(waypoints)
+
+        self.ahead = None
+        self.distance = math.inf
+        # True while the car is being paced to arrive on green; perception
+        # then doesn't stop for this light being red until it has to brake
+        self.arrivesOnGreen = False
+        # light whose prediction the camera contradicted on this approach
+        self._distrusted = None
+        self._mismatches = 0
+
+    def _set_route(self, waypoints):
+        # SteeringController indexes modulo N-1; the last point repeats the first
+        self.n = len(waypoints[0, :]) - 1
+        step = np.hypot(*np.diff(waypoints[:, :self.n + 1], axis=1))
+        self.arc = np.concatenate(([0.0], np.cumsum(step)))
+        self.lapLength = self.arc[self.n]
+
+        stops = []
+        for name, (x, y) in self.lights.items():
+            i = int(np.argmin(np.hypot(waypoints[0, :self.n] - x, waypoints[1, :self.n] - y)))
+            stops.append((i, name))
+        self.stops = sorted(stops)
+
+    # The controller was handed a new route (route_table.RouteHandOff), with
+    # wpi starting over at 0. The learnt light cycles are kept
+    def route_changed(self, waypoints):
+        self._set_route(waypoints)
+        self.arrivesOnGreen = False
+
+    # Perception loop: colour decision for the light in view
+    def observe(self, colour, t):
+        name = self.ahead
+        if name is None or self.distance >= self.observeRange:
+            return
+        estimator = self.estimators[name]
+        estimator.observe(colour, t)
+        model = estimator.model
+        if model is None or colour not in ('green', 'red'):
+            return
+        # near a predicted transition either colour is plausible
+        expected = predict(model, t)[0]
+        if (colour != expected and predict(model, t - self.greenMargin)[0] == expected
+                and predict(model, t + self.greenMargin)[0] == expected):
+            self._mismatches += 1
+            if self._mismatches >= estimator.confirm:
+                self.distrust()
+        else:
+            self._mismatches = 0
+
+    # No more advice for the light ahead until the car has passed it
+    def distrust(self):
+        self._distrusted = self.ahead
+        self.arrivesOnGreen = False
+
+    # controlLoop, every tick: the speed reference to use instead of v_ref
+    def update(self, wpi, v_ref):
+        i = wpi % self.n
+        name, d = None, math.inf
+        for index, light in self.stops:
+            ahead = self.arc[index] - self.arc[i]
+            if ahead < 0:
+                ahead += self.lapLength
+            if ahead < d:
+                name, d = light, ahead
+        if name != self.ahead:
+            self._distrusted = None
+            self._mismatches = 0
+        self.ahead = name
+        self.distance = d
+        d -= self.stopMargin
+
+        model = self.estimators[name].model if name is not None else None
+        if (model is None or name == self._distrusted or v_ref <= 0
+                or d <= 0 or d > self.adviseRange):
+            self.arrivesOnGreen = False
+            return v_ref
+
+        t = self.clock.time()
+        tArrive = t + d / v_ref
+        state, tGreen = predict(model, tArrive)
+        if state == 'green' and predict(model, tArrive + self.greenMargin)[0] == 'green':
+            self.arrivesOnGreen = True
+            return v_ref
+        v = d / (tGreen + self.greenMargin - t)
+        if v < self.minSpeed:
+            self.arrivesOnGreen = False
+            return v_ref
+        self.arrivesOnGreen = True
+        return v
+
+    def report(self):
+        lines = []
+        for name, estimator in self.estimators.items():
+            if estimator.model is None:
+                lines.append('%s: cycle not learned yet' % name)
+            else:
+                cycle, green, _ = estimator.model
+                lines.append('%s: cycle %.2f s, green %.2f s' % (name, cycle, green))
+        return '\n'.join(lines)
@@ -0,0 +1,199 @@
+"""
+light_scheduler.py
+
+Runs any number of QLabs traffic lights from one timer queue. Each light has
+its own phase plan (green/yellow/red durations and an offset into the cycle);
+the scheduler sleeps until the next transition of any light, sends only the
+state changes that are due (without waiting for confirmation) and broadcasts
+the true state of every light over UDP, so perception can be scored against
+ground truth.
+
+Broadcast messages are JSON:
+    {"seq": 12, "t": 1712345678.9,
+     "lights": {"light0": {"state": "red", "since": 1712345675.4}, ...}}
+"""
+
+# region: package imports
+import heapq
+import json
+import socket
+import time
+from collections import deque
+from threading import Thread, Lock
+
+#endregion
+
+GROUND_TRUTH_ADDRESS = ('127.0.0.1', 18010)
+
+# QLabsTrafficLight state ids
+STATE_IDS = {'red': 0, 'green': 1, 'yellow': 2}
+
+
+class PhasePlan:
+
+    def __init__(self, green=5.0, yellow=0.0, red=5.0, offset=0.0):
+        self.green = green
+        self.yellow = yellow
+        self.red = red
+        self.offset = offset
+
+        if min(green, yellow, red) < 0:
+            raise ValueError('Phase durations must not be negative')
+        self.cycle = green + yellow + red
+        if self.cycle <= 0:
+            raise ValueError('A phase plan needs a cycle longer than 0 s')
+        self.phases = [(s, d) for s, d in
+                       (('green', green), ('yellow', yellow), ('red', red)) if d > 0]
+
+    # State at time t (seconds since the scheduler started) and the time of
+    # the next transition
+    def state_at(self, t):
+        tc = (t + self.offset) % self.cycle
+        start = t - tc
+        for state, duration in self.phases:
+            if tc < duration:
+                return state, start + duration
+            tc -= duration
+            start += duration
+        state, duration = self.phases[0]
+        return state, start + duration
+
+
+class LightScheduler:
+
+    def __init__(self, address=GROUND_TRUTH_ADDRESS, heartbeat=1.0):
+        self.lights = {}
+        self.address = address
+        # seconds between broadcasts when nothing changes
+        self.heartbeat = heartbeat
+
+        self.states = {}
+        self.since = {}
+        self.seq = 0
+
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._running = False
+
+    # handle is a spawned QLabsTrafficLight (or anything with set_state)
+    def add_light(self, name, handle, plan):
+        self.lights[name] = (handle, plan)
+
+    def run(self, duration=None):
+        self._running = True
+        t0 = time.monotonic()
+        wall0 = time.time()
+        queue = []
+
+        for name, (handle, plan) in self.lights.items():
+            state, tNext = plan.state_at(0.0)
+            self._set(name, handle, state, wall0)
+            heapq.heappush(queue, (tNext, name))
+        self.broadcast()
+        nextBeat = self.heartbeat
+
+        while self._running and queue:
+            tEvent = min(queue[0][0], nextBeat)
+            if duration is not None and tEvent > duration:
+                break
+            delay = tEvent - (time.monotonic() - t0)
+            if delay > 0:
+                time.sleep(delay)
+
+            changed = False
+            while queue and queue[0][0] <= tEvent:
+                tDue, name = heapq.heappop(queue)
+                handle, plan = self.lights[name]
+                # evaluate just past the boundary so float error can't
+                # leave us in the phase that just ended
+                state, tNext = plan.state_at(tDue + 1e-6)
+                self._set(name, handle, state, wall0 + tDue)
+                heapq.heappush(queue, (tNext, name))
+                changed = True
+
+            if changed or tEvent >= nextBeat:
+                self.broadcast()
+                nextBeat = tEvent + self.heartbeat
+
+    def stop(self):
+        self._running = False
+
+    def broadcast(self):
+        self.seq += 1
+        message = {
+            'seq': self.seq,
+            't': time.time(),
+            'lights': {n: {'state': self.states[n], 'since': self.since[n]}
+                       for n in self.states},
+        }
+        try:
+            self._sock.sendto(json.dumps(message).encode(), self.address)
+        except OSError:
+            pass
+
+    def _set(self, name, handle, state, t):
+        if self.states.get(name) == state:
+            return
+        self.states[name] = state
+        self.since[name] = t
+        if handle is not None:
+            handle.set_state(STATE_IDS[state], waitForConfirmation=False)
+
+
+class GroundTruthListener:
+
+    def __init__(self, address=GROUND_TRUTH_ADDRESS, history=256):
+        self.address = address
+        self.history = history
+
+        self.transitions = {}
+        self.lastMessage = None
+
+        self._lock = Lock()
+        self._sock = None
+        self._thread = None
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(self.address)
+        self._sock.settimeout(0.5)
+        self._thread = Thread(target=self._listen, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    # True state of a light at wall-clock time t (default now), or None
+    def state(self, name, t=None):
+        if t is None:
+            t = time.time()
+        with self._lock:
+            for since, state in reversed(self.transitions.get(name, ())):
+                if since <= t:
+                    return state
+        return None
+
+    def _listen(self):
+        while self._sock is not None:
+            try:
+                data, _ = self._sock.recvfrom(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            try:
+                message = json.loads(data)
+                lights = [(name, light['since'], light['state'])
+                          for name, light in message['lights'].items()]
+            except (ValueError, KeyError, TypeError, AttributeError):
+                # not a scheduler broadcast; wait for the next one
+                continue
+            with self._lock:
+                self.lastMessage = message
+                for name, since, state in lights:
+                    h = self.transitions.setdefault(name, deque(maxlen=self.history))
+                    if not h or h[-1][0] != since:
+                        h.append((since, state))
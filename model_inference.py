@@ -2,17 +2,41 @@ from pal.products.qcar import QCarRealSense
 from ultralytics import YOLO
 from ultralytics.utils.plotting import Annotator
 import cv2
+from vis_sink import VisualisationSink
+from frame_bus import BusCamera
 imageWidth  = 640
 imageHeight = 480
-myCam  = QCarRealSense(mode='RGB&DEPTH',
-            frameWidthRGB=imageWidth,
-            frameHeightRGB=imageHeight)
+# Set useFrameBus to share the camera with SDCS_Main through frame_bus.py
+# (run python frame_bus.py first) instead of opening it here
+useFrameBus = False
+if useFrameBus:
+    myCam = BusCamera()
+else:
+    myCam  = QCarRealSense(mode='RGB&DEPTH',
+                frameWidthRGB=imageWidth,
+                frameHeightRGB=imageHeight)
 model = YOLO('yolov8s.pt' )
 Cone_model = YOLO('Cone.pt')
+# Detector confidence thresholds
+detectorConf = 0.6
+coneConf = 0.6
+# Drawing runs on its own thread at up to visFps; the windows are updated
+# by sink.show() in the loop below. Set visRecord to a path prefix to write
+# MJPEG video instead of opening windows, or VISUALISE to False to turn it
+# off.
+VISUALISE = True
+visFps = 10
+visRecord = None
+sink = VisualisationSink(maxFps=visFps, record=visRecord)
+if VISUALISE:
+    sink.start()
 try:
     while True:
         myCam.read_RGB()
-        results = model(myCam.imageBufferRGB,classes=[0,9,11,17,57,72],conf=0.6,verbose=False)  # return a list of Results objects
+        if myCam.imageBufferRGB is None:
+            # no frame from the bus yet
+            continue
+        results = model(myCam.imageBufferRGB,classes=[0,9,11,17,57,72],conf=detectorConf,verbose=False)  # return a list of Results objects
         for r in results:
             # annotator = Annotator(myCam.imageBufferRGB)
             boxes = r.boxes
@@ -20,14 +44,21 @@ try:
             #     b = box.xyxy[0]  # get box coordinates in (left, top, right, bottom) format
             #     c = box.cls
             #     annotator.box_label(b, model.names[int(c)])
-            cv2.imshow('YOLO V8 Detection', r.plot())
-            cv2.waitKey(1)  
-        coneresults = Cone_model(myCam.imageBufferRGB,conf=0.6,verbose=False)  # return a list of Results objects
+            if VISUALISE:
+                sink.submit('YOLO V8 Detection', r)
+        coneresults = Cone_model(myCam.imageBufferRGB,conf=coneConf,verbose=False)  # return a list of Results objects
         for c in coneresults :
             # cannotator = Annotator(myCam.imageBufferRGB)
             boxes = c.boxes
-            cv2.imshow('YOLO V8 CONE/OBJECTS Detection', c.plot())
-            cv2.waitKey(1)  
+            if VISUALISE:
+                sink.submit('YOLO V8 CONE/OBJECTS Detection', c)
+        if VISUALISE:
+            sink.show()
 except:
     print('OUTPUT')
+finally:
+    myCam.terminate()
+    if VISUALISE:
+        sink.stop()
+        print('visualisation: %d rendered, %d dropped' % (sink.rendered, sink.dropped))
 
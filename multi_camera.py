@@ -0,0 +1,186 @@
+"""
+multi_camera.py
+
+Captures the front RealSense RGB stream together with the QCar's four CSI
+cameras and runs the detector on all of them in one batched call.
+
+Every frame is letterboxed into its own slot of one preallocated batch
+tensor (see frame_ingest.py), so a single forward pass covers all cameras.
+Detections come back per camera, in that camera's pixel coordinates, with the
+camera geometry attached and a bearing relative to the car's heading.
+
+    python multi_camera.py      # compare batched vs per-camera inference
+"""
+
+# region: package imports
+import time
+
+import numpy as np
+import torch
+
+from frame_ingest import FrameIngest, STRIDE
+
+#endregion
+
+
+class CameraSpec:
+
+    # yaw: mounting angle relative to the car's heading [rad], left positive
+    # fov: horizontal field of view [rad]
+    def __init__(self, name, width, height, yaw, fov):
+        self.name = name
+        self.width = width
+        self.height = height
+        self.yaw = yaw
+        self.fov = fov
+
+    # Bearing of an image column relative to the car's heading
+    def bearing(self, x):
+        return self.yaw + (0.5 - x / self.width) * self.fov
+
+
+REALSENSE = CameraSpec('front_rgbd', 640, 480, 0.0, np.radians(69))
+CSI_WIDTH = 820
+CSI_HEIGHT = 410
+CSI_FOV = np.radians(160)
+CSI = [
+    CameraSpec('csi_right', CSI_WIDTH, CSI_HEIGHT, -np.pi/2, CSI_FOV),
+    CameraSpec('csi_back', CSI_WIDTH, CSI_HEIGHT, np.pi, CSI_FOV),
+    CameraSpec('csi_left', CSI_WIDTH, CSI_HEIGHT, np.pi/2, CSI_FOV),
+    CameraSpec('csi_front', CSI_WIDTH, CSI_HEIGHT, 0.0, CSI_FOV),
+]
+
+
+class Detection:
+
+    def __init__(self, camera, cls, conf, xyxy):
+        self.camera = camera
+        self.cls = cls
+        self.conf = conf
+        self.xyxy = xyxy
+
+    @property
+    def bearing(self):
+        return self.camera.bearing((self.xyxy[0] + self.xyxy[2]) / 2)
+
+
+class MultiCameraCapture:
+
+    # csi: names of the CSI cameras to open, a subset of CSI
+    def __init__(self, csi=('csi_right', 'csi_back', 'csi_left')):
+        from pal.products.qcar import QCarRealSense, QCarCameras
+
+        self.realsense = QCarRealSense(
+            mode='RGB&DEPTH',
+            frameWidthRGB=REALSENSE.width,
+            frameHeightRGB=REALSENSE.height)
+        names = [c.name for c in CSI]
+        self.cameras = QCarCameras(
+            frameWidth=CSI_WIDTH,
+            frameHeight=CSI_HEIGHT,
+            enableRight='csi_right' in csi,
+            enableBack='csi_back' in csi,
+            enableLeft='csi_left' in csi,
+            enableFront='csi_front' in csi)
+        self._csi = [(CSI[i], self.cameras.csi[i]) for i, n in enumerate(names) if n in csi]
+        self.specs = [REALSENSE] + [spec for spec, _ in self._csi]
+
+        # capture time of each frame in the last read(), and the spread
+        self.timestamps = {}
+        self.skew = 0.0
+
+    # Grab one frame from every camera, back to back, and return them in the
+    # order of self.specs
+    def read(self):
+        frames = []
+        self.realsense.read_RGB()
+        self.timestamps[REALSENSE.name] = time.time()
+        frames.append(self.realsense.imageBufferRGB)
+        for spec, camera in self._csi:
+            camera.read()
+            self.timestamps[spec.name] = time.time()
+            frames.append(camera.imageData)
+        self.skew = max(self.timestamps.values()) - min(self.timestamps.values())
+        return frames
+
+    def terminate(self):
+        self.realsense.terminate()
+        self.cameras.terminate()
+
+
+class BatchedDetector:
+
+    def __init__(self, model, specs, imgsz=640, device=None, **predictArgs):
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.device = torch.device(device)
+        self.model = model
+        self.specs = list(specs)
+        self.predictArgs = predictArgs
+
+        # the square canvas FrameIngest pads to is a stride multiple
+        self.imgsz = imgsz = int(np.ceil(imgsz / STRIDE) * STRIDE)
+        pin = self.device.type == 'cuda'
+        n = len(self.specs)
+        self.host = torch.empty((n, 3, imgsz, imgsz), dtype=torch.float32, pin_memory=pin)
+        if pin:
+            self.batch = torch.empty_like(self.host, device=self.device)
+        else:
+            self.batch = self.host
+        self.ingests = [
+            FrameIngest(frameWidth=spec.width, frameHeight=spec.height,
+                        imgsz=imgsz, device='cpu', square=True,
+                        host=self.host[i:i + 1])
+            for i, spec in enumerate(self.specs)]
+
+    # frames in the order of specs; returns {camera name: [Detection, ...]}
+    def detect(self, frames):
+        for ingest, frame in zip(self.ingests, frames):
+            ingest.prepare(frame)
+        if self.batch is not self.host:
+            self.batch.copy_(self.host, non_blocking=True)
+
+        results = self.model(self.batch, verbose=False, **self.predictArgs)
+
+        detections = {}
+        for spec, ingest, result in zip(self.specs, self.ingests, results):
+            boxes = result.boxes
+            detections[spec.name] = [
+                Detection(spec, int(c), float(p), ingest.to_frame(b))
+                for c, p, b in zip(boxes.cls, boxes.conf, boxes.xyxy)]
+        return detections
+
+
+if __name__ == '__main__':
+    from ultralytics import YOLO
+
+    model = YOLO('yolov8s.pt')
+    capture = MultiCameraCapture()
+    detector = BatchedDetector(model, capture.specs, classes=[9, 11], conf=0.7)
+    single = [FrameIngest(frameWidth=s.width, frameHeight=s.height) for s in capture.specs]
+
+    try:
+        frames = [f.copy() for f in capture.read()]
+        detector.detect(frames)
+
+        n = 20
+        t0 = time.time()
+        for _ in range(n):
+            detections = detector.detect(frames)
+        batched = (time.time() - t0) / n
+
+        t0 = time.time()
+        for _ in range(n):
+            for ingest, frame in zip(single, frames):
+                model(ingest.prepare(frame), classes=[9, 11], conf=0.7, verbose=False)
+        separate = (time.time() - t0) / n
+
+        print("%d cameras, capture skew %.1f ms" % (len(frames), capture.skew*1000))
+        print("batched  %.1f ms/frame set" % (batched*1000))
+        print("separate %.1f ms/frame set" % (separate*1000))
+        for name, dets in detections.items():
+            for d in dets:
+                print("%s: class %d conf %.2f bearing %.0f deg"
+                      % (name, d.cls, d.conf, np.degrees(d.bearing)))
+    finally:
+        capture.terminate()
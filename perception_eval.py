@@ -0,0 +1,374 @@
+"""
+perception_eval.py
+
+Accuracy against speed for the perception settings, measured on labelled
+frames.
+
+Sweeps the sign detector's confidence threshold and input size, the HSV
+windows of the traffic light colour check (light_colour.py) and the cone
+detector's confidence threshold. For every combination it scores the
+decisions against the labels (precision and recall of 'stop' and, if
+labelled, 'cone') and adds up the measured per-frame latency of the
+detectors and the decision logic. The table goes to perception_eval.csv and
+the accuracy/latency Pareto frontier to perception_eval.png (if matplotlib
+is installed). Cone.pt always runs at CONE_IMGSZ, as in cone.py.
+
+The settings currently in the code (detectorConf, detectorImgsz, hueWindow
+and satValWindow in SDCS_Main.py, coneConf in cone.py) are read from the
+source and always evaluated. --save-baseline stores their result in
+perception_baseline.json; --check exits with an error if the current
+settings now do worse than that baseline on precision, recall or latency.
+
+The decision rule is the one SDCS_Main.py drives with: its box area
+thresholds (redArea and stopArea, or the braking planner's minArea with
+useBrakingPlanner) and, with useEvidence, the landmark evidence filter
+(evidence.py) fed the frames one after another in labels.csv order. The
+light phase advisor is left out; it depends on timing the frames don't have.
+
+Labelled frames are a folder of images saved from imageBufferRGB, in the
+order they were captured, plus a labels.csv with a header row:
+    frame,decision,cone
+    0001.png,stop,pass
+    0002.png,pass,cone
+decision is 'stop' if perception should report a stop sign or red light to
+stop at in that frame (with the braking planner: one it should plan a stop
+for); the cone column is optional.
+
+    python perception_eval.py frames/
+    python perception_eval.py frames/ --conf 0.3:0.8:6 --imgsz 320,480,640 --hue 6,10,14
+    python perception_eval.py frames/ --save-baseline
+    python perception_eval.py frames/ --check
+"""
+
+# region: package imports
+import argparse
+import ast
+import contextlib
+import csv
+import io
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from braking import BrakingPlanner
+from evidence import EvidenceAccumulator
+from light_colour import classify_light
+
+#endregion
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(HERE, 'perception_baseline.json')
+
+# cone.py runs Cone.pt at the default input size
+CONE_IMGSZ = 640
+
+FIELDS = ['imgsz', 'conf', 'hue', 'satval', 'coneConf', 'precision', 'recall',
+          'cone_precision', 'cone_recall', 'f1', 'latency_ms', 'fps', 'pareto', 'current']
+
+
+# Settings in the code, read from the source (importing SDCS_Main would
+# start the car). wanted: {filename: {variable: key}}
+def read_settings(wanted):
+    settings = {}
+    for filename, names in wanted.items():
+        with open(os.path.join(HERE, filename)) as f:
+            tree = ast.parse(f.read())
+        for node in tree.body:
+            if (isinstance(node, ast.Assign) and len(node.targets) == 1
+                    and isinstance(node.targets[0], ast.Name) and node.targets[0].id in names):
+                settings[names[node.targets[0].id]] = ast.literal_eval(node.value)
+    return settings
+
+
+# The settings the sweep varies
+def code_settings():
+    return read_settings({'SDCS_Main.py': {'detectorConf': 'conf', 'detectorImgsz': 'imgsz',
+                                           'hueWindow': 'hue', 'satValWindow': 'satval'},
+                          'cone.py': {'coneConf': 'coneConf'}})
+
+
+# mainlogic's decision rule: {'redArea', 'stopArea', 'useEvidence'}
+def code_rule():
+    rule = read_settings({'SDCS_Main.py': {'redArea': 'redArea', 'stopArea': 'stopArea',
+                                           'useBrakingPlanner': 'useBrakingPlanner',
+                                           'useEvidence': 'useEvidence'}})
+    if rule.pop('useBrakingPlanner'):
+        # the planner takes every sighting it can plan from
+        rule['redArea'] = rule['stopArea'] = BrakingPlanner(None).minArea
+    return rule
+
+
+def load_frames(folder):
+    frames, labels = [], []
+    with open(os.path.join(folder, 'labels.csv'), newline='') as f:
+        for row in csv.DictReader(f):
+            image = cv2.imread(os.path.join(folder, row['frame']))
+            if image is None:
+                raise ValueError("Could not load image %s" % row['frame'])
+            frames.append(image)
+            labels.append(row)
+    return frames, labels
+
+
+# Box area in percent of the frame, as disI computes it
+def box_area(xyxy, frame):
+    x1, y1, x2, y2 = xyxy
+    return round(100.0 * (x2 - x1) * (y2 - y1) / (frame.shape[0] * frame.shape[1]), 3)
+
+
+# Detector boxes for every frame at input size imgsz, kept down to minConf,
+# and the time each frame took
+def run_signs(model, frames, imgsz, minConf):
+    from frame_ingest import FrameIngest
+
+    ingests = {}
+    boxes, latency = [], []
+    for i, frame in enumerate(frames):
+        h, w = frame.shape[:2]
+        if (w, h) not in ingests:
+            ingests[w, h] = FrameIngest(frameWidth=w, frameHeight=h, imgsz=imgsz)
+            # warm-up
+            model(ingests[w, h].prepare(frame), classes=[9, 11], conf=minConf, verbose=False)
+        ingest = ingests[w, h]
+        t0 = time.perf_counter()
+        results = model(ingest.prepare(frame), classes=[9, 11], conf=minConf, verbose=False)
+        boxes.append([(int(c), float(p), ingest.to_frame(b))
+                      for r in results for c, p, b in zip(r.boxes.cls, r.boxes.conf, r.boxes.xyxy)])
+        latency.append(time.perf_counter() - t0)
+    return boxes, float(np.median(latency))
+
+
+def run_cones(model, frames, minConf):
+    model(frames[0], conf=minConf, imgsz=CONE_IMGSZ, verbose=False)
+    boxes, latency = [], []
+    for frame in frames:
+        t0 = time.perf_counter()
+        results = model(frame, conf=minConf, imgsz=CONE_IMGSZ, verbose=False)
+        boxes.append([r.boxes.cpu() for r in results])
+        latency.append(time.perf_counter() - t0)
+    return boxes, float(np.median(latency))
+
+
+# 'stop_sign' or 'light_red' if mainlogic would stop for the box, else None
+def landmark(box, frame, hue, satval, rule):
+    cls, p, xyxy = box
+    x1, y1, x2, y2 = xyxy
+    if x2 <= x1 or y2 <= y1:
+        return None
+    area = box_area(xyxy, frame)
+    if cls == 11 and area >= rule['stopArea']:
+        return 'stop_sign'
+    if cls == 9 and area >= rule['redArea']:
+        hsv = cv2.cvtColor(frame[y1:y2, x1:x2], cv2.COLOR_BGR2HSV)
+        if classify_light(hsv, hue, satval) == 'red':
+            return 'light_red'
+    return None
+
+
+# Decisions for the frames in order, as mov_logic makes them: from the most
+# confident box of each frame, or with useEvidence from the evidence of
+# every box over the frames so far
+def sign_decisions(signBoxes, frames, conf, hue, satval, rule):
+    decisions = []
+    evidence = EvidenceAccumulator(['stop_sign', 'light_red'])
+    for boxes, frame in zip(signBoxes, frames):
+        boxes = [b for b in boxes if b[1] >= conf]
+        if not rule['useEvidence']:
+            stop = bool(boxes) and landmark(boxes[0], frame, hue, satval, rule) is not None
+            decisions.append('stop' if stop else 'pass')
+            continue
+        observations = {}
+        for box in boxes:
+            name = landmark(box, frame, hue, satval, rule)
+            if name is not None:
+                observations[name] = max(observations.get(name, 0.0), box[1])
+        decisions.append('stop' if evidence.update(observations) else 'pass')
+    return decisions
+
+
+def precision_recall(predicted, truth, positive):
+    tp = sum(p == positive and t == positive for p, t in zip(predicted, truth))
+    fp = sum(p == positive and t != positive for p, t in zip(predicted, truth))
+    fn = sum(p != positive and t == positive for p, t in zip(predicted, truth))
+    precision = tp / (tp + fp) if tp + fp else 1.0
+    recall = tp / (tp + fn) if tp + fn else 1.0
+    return precision, recall
+
+
+def f1(precision, recall):
+    return 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+
+def evaluate(frames, labels, grid, current, rule):
+    from ultralytics import YOLO
+
+    signModel = YOLO('yolov8s.pt')
+    truth = [row['decision'] for row in labels]
+    coneTruth = [row.get('cone') for row in labels]
+    useCones = all(coneTruth)
+    if useCones:
+        # cone.py loads Cone.pt and has the decision rule
+        import cone
+        coneBoxes, coneLatency = run_cones(cone.model, frames, min(grid['coneConf']))
+
+    results = []
+    for imgsz in grid['imgsz']:
+        signBoxes, signLatency = run_signs(signModel, frames, imgsz, min(grid['conf']))
+
+        for conf, hue, satval, coneConf in itertools.product(
+                grid['conf'], grid['hue'], grid['satval'], grid['coneConf'] if useCones else [None]):
+            t0 = time.perf_counter()
+            predicted = sign_decisions(signBoxes, frames, conf, hue, satval, rule)
+            latency = signLatency + (time.perf_counter() - t0) / len(frames)
+            precision, recall = precision_recall(predicted, truth, 'stop')
+            row = {'imgsz': imgsz, 'conf': conf, 'hue': hue, 'satval': satval,
+                   'coneConf': coneConf, 'precision': precision, 'recall': recall,
+                   'cone_precision': '', 'cone_recall': ''}
+            scores = [f1(precision, recall)]
+
+            if useCones:
+                t0 = time.perf_counter()
+                # cone_decision prints a line per detection
+                with contextlib.redirect_stdout(io.StringIO()):
+                    conePredicted = [cone.cone_decision([b[b.conf >= coneConf] for b in boxes], f)
+                                     for boxes, f in zip(coneBoxes, frames)]
+                latency += coneLatency + (time.perf_counter() - t0) / len(frames)
+                row['cone_precision'], row['cone_recall'] = precision_recall(conePredicted, coneTruth, 'cone')
+                scores.append(f1(row['cone_precision'], row['cone_recall']))
+
+            row['f1'] = float(np.mean(scores))
+            row['latency_ms'] = 1000 * latency
+            row['fps'] = 1.0 / latency
+            row['current'] = all(row[k] == v for k, v in current.items() if k != 'coneConf' or useCones)
+            results.append(row)
+
+    # Pareto frontier: no other setting is both faster and more accurate
+    best = -1.0
+    for row in sorted(results, key=lambda r: (r['latency_ms'], -r['f1'])):
+        row['pareto'] = row['f1'] > best
+        best = max(best, row['f1'])
+    return results
+
+
+def plot(results, path):
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib not installed, no plot")
+        return
+    fig, ax = plt.subplots(figsize=(8, 5))
+    ax.scatter([r['latency_ms'] for r in results], [r['f1'] for r in results],
+               s=10, c='0.7', label='settings')
+    front = sorted((r for r in results if r['pareto']), key=lambda r: r['latency_ms'])
+    ax.plot([r['latency_ms'] for r in front], [r['f1'] for r in front], 'o-', label='Pareto frontier')
+    for r in front:
+        ax.annotate('%d/%.2f' % (r['imgsz'], r['conf']), (r['latency_ms'], r['f1']),
+                    fontsize=7, xytext=(3, -8), textcoords='offset points')
+    current = [r for r in results if r['current']]
+    if current:
+        ax.plot(current[0]['latency_ms'], current[0]['f1'], 'r*', markersize=14, label='current')
+    ax.set_xlabel('Latency per frame [ms]')
+    ax.set_ylabel('Decision F1')
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(path, dpi=120)
+
+
+# Problems with row compared to baseline; empty if it is no worse
+def compare(row, baseline, accuracyTolerance, latencyTolerance):
+    problems = []
+    for key in ('precision', 'recall', 'cone_precision', 'cone_recall'):
+        if baseline.get(key, '') != '' and row[key] != '' and row[key] < baseline[key] - accuracyTolerance:
+            problems.append("%s %.3f < baseline %.3f" % (key, row[key], baseline[key]))
+    if row['latency_ms'] > baseline['latency_ms'] * (1 + latencyTolerance):
+        problems.append("latency %.1f ms > baseline %.1f ms" % (row['latency_ms'], baseline['latency_ms']))
+    return problems
+
+
+# "a,b,c" is a list of values, "start:stop:num" is a linspace
+def parse_values(text, kind=float):
+    if ':' in text:
+        start, stop, num = text.split(':')
+        return [kind(round(v, 4)) for v in np.linspace(float(start), float(stop), int(num))]
+    return [kind(v) for v in text.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Perception accuracy vs throughput')
+    parser.add_argument('frames', help='folder with the images and labels.csv')
+    parser.add_argument('--conf', default='0.3:0.8:6')
+    parser.add_argument('--imgsz', default='320,480,640')
+    parser.add_argument('--hue', default='6,10,14')
+    parser.add_argument('--satval', default='30,40,50')
+    parser.add_argument('--cone-conf', default='0.5,0.65,0.8')
+    parser.add_argument('--out', default='perception_eval.csv')
+    parser.add_argument('--plot', default='perception_eval.png')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true',
+                        help='exit with an error if the current settings are worse than the baseline')
+    parser.add_argument('--accuracy-tolerance', type=float, default=0.02)
+    parser.add_argument('--latency-tolerance', type=float, default=0.15,
+                        help='allowed relative latency increase')
+    args = parser.parse_args()
+
+    current = code_settings()
+    rule = code_rule()
+    grid = {'conf': parse_values(args.conf), 'imgsz': parse_values(args.imgsz, int),
+            'hue': parse_values(args.hue, int), 'satval': parse_values(args.satval, int),
+            'coneConf': parse_values(args.cone_conf)}
+    # the current settings are always part of the sweep
+    for key, value in current.items():
+        if value not in grid[key]:
+            grid[key].append(value)
+
+    frames, labels = load_frames(args.frames)
+    print("%d labelled frames, %d settings" % (len(frames), int(np.prod([len(v) for v in grid.values()]))))
+    print("Decision rule: %s" % rule)
+    t0 = time.time()
+    results = evaluate(frames, labels, grid, current, rule)
+    print("Done in %.1f s" % (time.time() - t0))
+
+    with open(args.out, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        for row in results:
+            writer.writerow(row)
+    plot(results, args.plot)
+
+    for row in sorted((r for r in results if r['pareto']), key=lambda r: r['latency_ms']):
+        print("imgsz %4d conf %.2f hue %2d satval %2d  P %.3f R %.3f  %6.1f ms%s" % (
+            row['imgsz'], row['conf'], row['hue'], row['satval'], row['precision'],
+            row['recall'], row['latency_ms'], '  <- current' if row['current'] else ''))
+
+    now = next(r for r in results if r['current'])
+    print("Current settings %s: P %.3f R %.3f, %.1f ms (%.0f fps)" % (
+        current, now['precision'], now['recall'], now['latency_ms'], now['fps']))
+
+    if args.save_baseline:
+        baseline = {k: now[k] for k in ('precision', 'recall', 'cone_precision', 'cone_recall', 'latency_ms')}
+        baseline.update({'settings': current, 'rule': rule, 'frames': len(frames), 'machine': platform.node()})
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print("Baseline saved to %s" % args.baseline)
+
+    if args.check:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('machine') != platform.node():
+            print("Warning: baseline latency was measured on %s" % baseline.get('machine'))
+        if baseline.get('rule') != rule:
+            print("Warning: baseline was measured with decision rule %s" % baseline.get('rule'))
+        problems = compare(now, baseline, args.accuracy_tolerance, args.latency_tolerance)
+        if problems:
+            print("FAILED: " + '; '.join(problems))
+            sys.exit(1)
+        print("OK: no worse than the baseline")
@@ -0,0 +1,153 @@
+"""
+qlabs_standin.py
+
+Local stand-in for the QLabs server, for exercising scene_loader and the
+setup scripts without the simulator. It speaks the QLabs container framing
+on the usual port and acknowledges every container with the same class and
+actor number and function id + 1, which is how QLabs pairs requests with
+their *_ACK / *_RESPONSE replies. Each received container is recorded so the
+number and order of requests can be checked afterwards.
+
+    python qlabs_standin.py            # serve on localhost:18000
+"""
+
+# region: package imports
+import socket
+import struct
+import time
+from threading import Thread, Lock
+
+#endregion
+
+QLABS_PORT = 18000
+PACKET_START = 123
+CONTAINER_HEADER_SIZE = 13
+
+FCN_REQUEST_PING = 1
+
+# Default acknowledgement payload: status byte 0 (success) padded to an int32
+# so acks that carry a count (e.g. destroy) can also be unpacked
+DEFAULT_ACK_PAYLOAD = bytes(4)
+
+
+class QLabsStandIn:
+
+    def __init__(self, host='localhost', port=QLABS_PORT, latency=0.0):
+        self.host = host
+        self.port = port
+        # seconds to wait before each acknowledgement, to mimic a slow sim
+        self.latency = latency
+
+        self.received = []
+        self.ackPayloads = {FCN_REQUEST_PING: b'\x01'}
+
+        self._lock = Lock()
+        self._server = None
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((self.host, self.port))
+        self.port = self._server.getsockname()[1]
+        self._server.listen(1)
+        self._running = True
+        self._thread = Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._server is not None:
+            self._server.close()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # Containers received so far as (classID, actorNumber, function, payload)
+    def containers(self, classID=None, function=None):
+        with self._lock:
+            return [c for c in self.received
+                    if (classID is None or c[0] == classID)
+                    and (function is None or c[2] == function)]
+
+    def _serve(self):
+        while self._running:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            with conn:
+                self._handle(conn)
+
+    def _handle(self, conn):
+        buffer = b''
+        while self._running:
+            try:
+                data = conn.recv(65536)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer += data
+            while len(buffer) >= 5:
+                packetSize = struct.unpack('>i', buffer[0:4])[0]
+                if len(buffer) < 4 + packetSize:
+                    break
+                if buffer[4] != PACKET_START:
+                    return
+                packet = buffer[5:4 + packetSize]
+                buffer = buffer[4 + packetSize:]
+                replies = [self._acknowledge(c) for c in parse_containers(packet)]
+                if self.latency > 0:
+                    time.sleep(self.latency)
+                conn.sendall(pack_packet(replies))
+
+    def _acknowledge(self, container):
+        classID, actorNumber, function, payload = container
+        with self._lock:
+            self.received.append(container)
+        ack = self.ackPayloads.get(function, DEFAULT_ACK_PAYLOAD)
+        return (classID, actorNumber, function + 1, ack)
+
+
+# Split the body of one packet into (classID, actorNumber, function, payload)
+def parse_containers(packet):
+    containers = []
+    i = 0
+    while i + CONTAINER_HEADER_SIZE <= len(packet):
+        size, classID, actorNumber, function = struct.unpack(
+            '>iiiB', packet[i:i + CONTAINER_HEADER_SIZE])
+        payload = bytes(packet[i + CONTAINER_HEADER_SIZE:i + size])
+        containers.append((classID, actorNumber, function, payload))
+        i += size
+    return containers
+
+
+def pack_container(classID, actorNumber, function, payload=b''):
+    return struct.pack('>iiiB', CONTAINER_HEADER_SIZE + len(payload),
+                       classID, actorNumber, function) + payload
+
+
+def pack_packet(containers):
+    body = b''.join(pack_container(*c) for c in containers)
+    return struct.pack('>iB', len(body) + 1, PACKET_START) + body
+
+
+if __name__ == '__main__':
+    server = QLabsStandIn().start()
+    print("QLabs stand-in listening on %s:%d" % (server.host, server.port))
+    try:
+        while True:
+            time.sleep(1.0)
+            print("%d containers received" % len(server.received))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
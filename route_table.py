@@ -0,0 +1,185 @@
+"""
+route_table.py
+
+Shortest routes between every pair of SDCSRoadMap nodes, precomputed so a
+running SteeringController can be handed a new route without a planning
+pause (see RouteHandOff).
+
+Routes are found with Floyd-Warshall over the roadmap edge lengths. Only a
+next-hop matrix is kept for the node sequences; the waypoints of every
+route are stored back to back in one 2xM float32 array with a table of
+offsets, so route(i, j) returns a view in constant time. The table is cached
+in route_table.npz next to this file and rebuilt when the roadmap changes.
+
+    python route_table.py       # build the cache and print its size
+"""
+
+# region: package imports
+import hashlib
+import os
+from threading import Lock
+
+import numpy as np
+
+#endregion
+
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'route_table.npz')
+
+
+# Fingerprint of the roadmap geometry, to invalidate the cache
+def roadmap_key(roadmap):
+    h = hashlib.sha1()
+    for node in roadmap.nodes:
+        h.update(np.asarray(node.pose, dtype=np.float64).tobytes())
+    for edge in roadmap.edges:
+        h.update(np.int64([roadmap.nodes.index(edge.fromNode),
+                           roadmap.nodes.index(edge.toNode)]).tobytes())
+        h.update(np.float64(edge.length).tobytes())
+    return h.hexdigest()
+
+
+class RouteTable:
+
+    def __init__(self, nextHop, offsets, waypoints, key=None):
+        self.nextHop = nextHop
+        self.offsets = offsets
+        self.waypoints = waypoints
+        self.key = key
+        self.n = len(nextHop)
+
+    @classmethod
+    def build(cls, roadmap):
+        nodes = roadmap.nodes
+        n = len(nodes)
+        index = {id(node): i for i, node in enumerate(nodes)}
+
+        dist = np.full((n, n), np.inf)
+        np.fill_diagonal(dist, 0.0)
+        nextHop = np.full((n, n), -1, dtype=np.int32)
+        edgeOf = {}
+        for edge in roadmap.edges:
+            a, b = index[id(edge.fromNode)], index[id(edge.toNode)]
+            if edge.length < dist[a, b]:
+                dist[a, b] = edge.length
+                nextHop[a, b] = b
+                edgeOf[a, b] = edge
+        for i in range(n):
+            nextHop[i, i] = i
+
+        for k in range(n):
+            through = dist[:, k:k + 1] + dist[k:k + 1, :]
+            better = through < dist
+            dist[better] = through[better]
+            nextHop[better] = np.broadcast_to(nextHop[:, k:k + 1], (n, n))[better]
+
+        # concatenate the edge waypoints of every route into one array
+        chunks = []
+        offsets = np.zeros((n, n + 1), dtype=np.int64)
+        total = 0
+        for i in range(n):
+            for j in range(n):
+                offsets[i, j] = total
+                path = cls._route_nodes(nextHop, i, j)
+                if len(path) < 2:
+                    continue
+                for a, b in zip(path[:-1], path[1:]):
+                    chunks.append(edgeOf[a, b].waypoints[:, :-1])
+                    total += chunks[-1].shape[1]
+                chunks.append(edgeOf[path[-2], path[-1]].waypoints[:, -1:])
+                total += 1
+            offsets[i, n] = total
+        waypoints = np.hstack(chunks).astype(np.float32) if chunks else np.zeros((2, 0), np.float32)
+        return cls(nextHop, offsets, waypoints, roadmap_key(roadmap))
+
+    @classmethod
+    def load_or_build(cls, roadmap, path=CACHE_FILE):
+        key = roadmap_key(roadmap)
+        if os.path.exists(path):
+            data = np.load(path)
+            if str(data['key']) == key:
+                return cls(data['nextHop'], data['offsets'], data['waypoints'], key)
+        table = cls.build(roadmap)
+        table.save(path)
+        return table
+
+    def save(self, path=CACHE_FILE):
+        np.savez_compressed(path, nextHop=self.nextHop, offsets=self.offsets,
+                            waypoints=self.waypoints, key=np.array(self.key))
+
+    @staticmethod
+    def _route_nodes(nextHop, i, j):
+        if nextHop[i, j] < 0:
+            return []
+        path = [i]
+        while i != j:
+            i = int(nextHop[i, j])
+            path.append(i)
+        return path
+
+    # Node sequence from i to j, empty if j can't be reached
+    def nodes(self, i, j):
+        return self._route_nodes(self.nextHop, i, j)
+
+    # 2xM waypoints from node i to node j (a view, no copy)
+    def route(self, i, j):
+        return self.waypoints[:, self.offsets[i, j]:self.offsets[i, j + 1]]
+
+    # Waypoints through a sequence of nodes, like SDCSRoadMap.generate_path
+    def mission(self, nodeSequence):
+        parts = [self.route(a, b) for a, b in zip(nodeSequence[:-1], nodeSequence[1:])]
+        parts = [p[:, :-1] for p in parts[:-1]] + parts[-1:]
+        return np.hstack(parts)
+
+
+# Switch a SteeringController onto a new route, indexed from 0. Only from
+# the thread that calls controller.update(); others use RouteHandOff.
+def hand_off(controller, waypoints, cyclic=None):
+    controller.wp = waypoints
+    controller.N = len(waypoints[0, :])
+    controller.wpi = 0
+    if cyclic is not None:
+        controller.cyclic = cyclic
+
+
+class RouteHandOff:
+
+    # Hands new routes to a SteeringController that controlLoop is driving.
+    # request() can be called from any thread and only fills a slot;
+    # controlLoop calls apply() before steeringController.update(), so wp,
+    # N and wpi change together on the control thread. The new route has its
+    # own index space from 0, so every listener (LapMetrics, DetourLibrary,
+    # LightPhaseAdvisor) gets route_changed(waypoints) to start over on it.
+    def __init__(self, listeners=()):
+        self.listeners = list(listeners)
+        # (sequence number, waypoints, cyclic), replaced whole
+        self._slot = (0, None, None)
+        self._applied = 0
+        self._lock = Lock()
+
+    def request(self, waypoints, cyclic=None):
+        with self._lock:
+            self._slot = (self._slot[0] + 1, waypoints, cyclic)
+
+    # controlLoop, every tick: True if a new route was switched to
+    def apply(self, controller):
+        seq, waypoints, cyclic = self._slot
+        if seq == self._applied:
+            return False
+        self._applied = seq
+        hand_off(controller, waypoints, cyclic)
+        for listener in self.listeners:
+            listener.route_changed(waypoints)
+        return True
+
+
+if __name__ == '__main__':
+    import time
+    from hal.products.mats import SDCSRoadMap
+
+    roadmap = SDCSRoadMap(leftHandTraffic=False)
+    t0 = time.time()
+    table = RouteTable.build(roadmap)
+    table.save()
+    print("%d nodes, %d waypoints (%.1f kB) built in %.2f s" % (
+        table.n, table.waypoints.shape[1], table.waypoints.nbytes / 1024, time.time() - t0))
+    print("10 -> 22:", table.nodes(10, 22))
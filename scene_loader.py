@@ -0,0 +1,160 @@
+"""
+scene_loader.py
+
+Spawns a QLabs scene from a declarative description (see
+competition_scene.json). Every spawn request is sent without waiting for its
+acknowledgement; QLabs handles requests in order, so a single ping at the end
+confirms the whole batch. reset_scene() moves the actors of an already loaded
+scene back to their transforms instead of destroying and respawning them.
+"""
+
+# region: package imports
+import json
+import math
+
+from qvl.qcar import QLabsQCar
+from qvl.free_camera import QLabsFreeCamera
+from qvl.basic_shape import QLabsBasicShape
+from qvl.system import QLabsSystem
+from qvl.walls import QLabsWalls
+from qvl.flooring import QLabsFlooring
+from qvl.stop_sign import QLabsStopSign
+from qvl.crosswalk import QLabsCrosswalk
+
+#endregion
+
+ACTOR_CLASSES = {
+    'flooring': QLabsFlooring,
+    'walls': QLabsWalls,
+    'qcar': QLabsQCar,
+    'basic_shape': QLabsBasicShape,
+    'free_camera': QLabsFreeCamera,
+    'stop_sign': QLabsStopSign,
+    'crosswalk': QLabsCrosswalk,
+}
+
+
+# Read a scene file
+def load_scene(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+# World transform of an actor entry, with the scene offset and any per-actor
+# overrides (e.g. the car's initial pose) applied
+def actor_transform(scene, actor, overrides=None):
+    entry = dict(actor)
+    if overrides and actor['name'] in overrides:
+        entry.update(overrides[actor['name']])
+    location = list(entry['location'])
+    if entry.get('offset', True) and not entry.get('parent'):
+        location = [l + o for l, o in zip(location, scene.get('offset', [0, 0, 0]))]
+    return location, list(entry['rotation']), list(entry.get('scale', [1, 1, 1]))
+
+
+def _configuration(handle, actor):
+    config = actor.get('configuration', 0)
+    if isinstance(config, str):
+        config = getattr(handle, config)
+    return config
+
+
+def _spawn(qlabs, scene, actor, handles, overrides):
+    handle = ACTOR_CLASSES[actor['class']](qlabs)
+    location, rotation, scale = actor_transform(scene, actor, overrides)
+    parent = actor.get('parent')
+    if parent:
+        parentHandle = handles[parent['name']]
+        handle.spawn_id_and_parent_with_relative_transform(
+            actorNumber=actor['actorNumber'],
+            location=location,
+            rotation=[math.radians(r) for r in rotation],
+            scale=scale,
+            configuration=_configuration(handle, actor),
+            parentClassID=parentHandle.classID,
+            parentActorNumber=parent['actorNumber'],
+            parentComponent=parent.get('component', 0),
+            waitForConfirmation=False)
+    else:
+        handle.spawn_id_degrees(
+            actorNumber=actor['actorNumber'],
+            location=location,
+            rotation=rotation,
+            scale=scale,
+            configuration=_configuration(handle, actor),
+            waitForConfirmation=False)
+
+    if 'dynamics' in actor:
+        handle.set_enable_dynamics(actor['dynamics'], waitForConfirmation=False)
+    material = actor.get('material')
+    if material:
+        handle.set_material_properties(
+            color=material['color'],
+            roughness=material.get('roughness', 0.4),
+            metallic=material.get('metallic', False),
+            waitForConfirmation=False)
+    return handle
+
+
+# Spawn every actor of the scene and return the handles by name.
+# overrides maps an actor name to replacement keys, e.g.
+# {'car': {'location': [...], 'rotation': [...]}}
+def spawn_scene(qlabs, scene, overrides=None):
+    handles = {}
+    if 'title' in scene:
+        QLabsSystem(qlabs).set_title_string(scene['title'], waitForConfirmation=False)
+
+    for actor in scene['actors']:
+        handles[actor['name']] = _spawn(qlabs, scene, actor, handles, overrides)
+
+    confirm(handles)
+
+    for actor in scene['actors']:
+        if actor.get('possess'):
+            handles[actor['name']].possess()
+    return handles
+
+
+# Block until QLabs has processed every request sent so far
+def confirm(handles):
+    if not handles:
+        return True
+    last = list(handles.values())[-1]
+    return last.ping()
+
+
+def _move(handle, location, rotation, scale, actorNumber, configuration):
+    if isinstance(handle, QLabsQCar):
+        handle.set_transform_and_request_state_degrees(
+            location=location, rotation=rotation, enableDynamics=True,
+            headlights=False, leftTurnSignal=False, rightTurnSignal=False,
+            brakeSignal=False, reverseSignal=False, waitForConfirmation=False)
+    elif isinstance(handle, QLabsFreeCamera):
+        handle.set_transform_degrees(location, rotation)
+    elif hasattr(handle, 'set_transform_degrees'):
+        handle.set_transform_degrees(location, rotation, scale, waitForConfirmation=False)
+    else:
+        # Static props without a transform setter are respawned in place
+        handle.destroy()
+        handle.spawn_id_degrees(
+            actorNumber=actorNumber, location=location, rotation=rotation,
+            scale=scale, configuration=configuration, waitForConfirmation=False)
+
+
+# Incremental reset: put the actors of a loaded scene back in place.
+# Parented actors follow their parent and are left alone. Actors missing
+# from handles are spawned.
+def reset_scene(qlabs, scene, handles, overrides=None):
+    for actor in scene['actors']:
+        handle = handles.get(actor['name'])
+        if handle is None:
+            handles[actor['name']] = _spawn(qlabs, scene, actor, handles, overrides)
+            continue
+        if actor.get('parent'):
+            continue
+        location, rotation, scale = actor_transform(scene, actor, overrides)
+        _move(handle, location, rotation, scale,
+              actor['actorNumber'], _configuration(handle, actor))
+
+    confirm(handles)
+    return handles
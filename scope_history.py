@@ -0,0 +1,164 @@
+"""
+scope_history.py
+
+Fixed-size, multi-resolution history for scope signals.
+
+Each SignalHistory keeps the most recent samples at full resolution in a
+ring buffer. Every sample is also folded into buckets of factor, factor**2,
+... samples, one ring buffer per level, so older data survives at coarser and
+coarser resolution. Buckets keep the min and max of each channel (time
+signals, so spikes stay visible) or the mean (XY trajectories). Memory is
+allocated once and append() is O(1) amortised, so memory use and the number
+of points handed to the plot stay the same however long the car runs.
+append() (controlLoop) and series() (the GUI) may run on different threads
+and take a lock.
+
+save_histories() writes a set of histories to an .npz file at the end of a
+run; python scope_history.py <file> plots the whole run from it.
+
+    python scope_history.py scope_history.npz
+"""
+
+# region: package imports
+import sys
+from threading import Lock
+
+import numpy as np
+
+#endregion
+
+
+class _Ring:
+
+    def __init__(self, size, width):
+        self.t = np.zeros(size)
+        self.v = np.zeros((size, width))
+        self.size = size
+        self.count = 0
+        self.head = 0
+
+    def push(self, t, v):
+        self.t[self.head] = t
+        self.v[self.head] = v
+        self.head = (self.head + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    # Contents, oldest first
+    def ordered(self):
+        if self.count < self.size:
+            return self.t[:self.count], self.v[:self.count]
+        idx = np.r_[self.head:self.size, 0:self.head]
+        return self.t[idx], self.v[idx]
+
+
+class SignalHistory:
+
+    # width: channels per sample (1 for a signal, 2 for an XY trajectory)
+    # reduce: 'minmax' keeps bucket extremes, 'mean' bucket averages
+    def __init__(self, width=1, recent=2000, levels=3, factor=10,
+                 levelSize=1000, reduce='minmax'):
+        self.width = width
+        self.factor = factor
+        self.reduce = reduce
+        self.recent = _Ring(recent, width)
+
+        # minmax buckets store min and max side by side
+        bucketWidth = 2*width if reduce == 'minmax' else width
+        self.levels = [_Ring(levelSize, bucketWidth) for _ in range(levels)]
+        self._pending = np.zeros((levels, bucketWidth))
+        self._pendingT = np.zeros(levels)
+        self._pendingCount = [0]*levels
+        self._sample = np.zeros(bucketWidth)
+        self._lock = Lock()
+
+    def append(self, t, values):
+        w = self.width
+        with self._lock:
+            self._sample[:w] = values
+            if self.reduce == 'minmax':
+                self._sample[w:] = self._sample[:w]
+            self.recent.push(t, self._sample[:w])
+            self._fold(0, t, self._sample)
+
+    def _fold(self, level, t, bucket):
+        if level >= len(self.levels):
+            return
+        pending = self._pending[level]
+        w = self.width
+        if self._pendingCount[level] == 0:
+            self._pendingT[level] = t
+            pending[:] = bucket
+        elif self.reduce == 'minmax':
+            np.minimum(pending[:w], bucket[:w], out=pending[:w])
+            np.maximum(pending[w:], bucket[w:], out=pending[w:])
+        else:
+            pending += bucket
+        self._pendingCount[level] += 1
+
+        if self._pendingCount[level] >= self.factor:
+            if self.reduce == 'mean':
+                pending /= self.factor
+            self.levels[level].push(self._pendingT[level], pending)
+            self._pendingCount[level] = 0
+            self._fold(level + 1, self._pendingT[level], pending)
+
+    # Whole history as (t, values), coarsest level first and each level only
+    # where no finer data exists. minmax buckets contribute two points each
+    # (min then max) so the envelope is drawn.
+    def series(self):
+        with self._lock:
+            return self._series()
+
+    def _series(self):
+        ts, vs = [], []
+        tFiner = np.inf
+        rings = [self.recent] + self.levels
+        parts = []
+        for i, ring in enumerate(rings):
+            t, v = ring.ordered()
+            if i > 0:
+                keep = t < tFiner
+                t, v = t[keep], v[keep]
+                if self.reduce == 'minmax':
+                    w = self.width
+                    t = np.repeat(t, 2)
+                    v = np.stack((v[:, :w], v[:, w:]), axis=1).reshape(-1, w)
+            parts.append((t, v))
+            if len(t):
+                tFiner = min(tFiner, t[0])
+        for t, v in reversed(parts):
+            ts.append(t)
+            vs.append(v)
+        return np.concatenate(ts), np.concatenate(vs)
+
+    # Draw an XY history (width 2) into a pyqtgraph PlotDataItem
+    def plot_xy(self, item):
+        _, v = self.series()
+        item.setData(v[:, 0], v[:, 1])
+
+
+# Save {name: SignalHistory} as name_t / name arrays in one .npz file
+def save_histories(path, histories):
+    arrays = {}
+    for name, history in histories.items():
+        arrays[name + '_t'], arrays[name] = history.series()
+    np.savez_compressed(path, **arrays)
+
+
+def plot_saved(path):
+    import matplotlib.pyplot as plt
+
+    data = np.load(path)
+    names = [k[:-2] for k in data.files if k.endswith('_t')]
+    fig, axes = plt.subplots(len(names), 1, sharex=True, figsize=(10, 2*len(names)))
+    for ax, name in zip(np.atleast_1d(axes), names):
+        ax.plot(data[name + '_t'], data[name])
+        ax.set_ylabel(name)
+    np.atleast_1d(axes)[-1].set_xlabel('Time [s]')
+    fig.tight_layout()
+    plt.show()
+
+
+if __name__ == '__main__':
+    plot_saved(sys.argv[1] if len(sys.argv) > 1 else 'scope_history.npz')
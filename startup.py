@@ -0,0 +1,88 @@
+"""
+startup.py
+
+Staged start-up helpers for SDCS_Main.
+
+BackgroundLoad runs a slow set-up function (heavy imports, model load,
+warm-up inference) on its own thread while the controller and sensors come
+up, and only reports ready once that function has returned. StartupLog
+records how long each milestone took from the import of this module (so
+import it first) and appends one row per run to startup_log.csv, so start-up
+regressions show up over time.
+"""
+
+# region: package imports
+import csv
+import os
+import time
+from threading import Thread, Event
+
+#endregion
+
+# Start of the run, as near to process start as an import gets
+T_START = time.perf_counter()
+
+LOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_log.csv')
+
+
+class StartupLog:
+
+    # milestones: names in the order they are expected, used as csv columns
+    def __init__(self, milestones, path=LOG_FILE):
+        self.t0 = T_START
+        self.milestones = list(milestones)
+        self.path = path
+        self.marks = {}
+
+    # Record a milestone the first time it is reached
+    def mark(self, name):
+        if name in self.marks:
+            return
+        self.marks[name] = time.perf_counter() - self.t0
+        print('Startup: %s after %.2f s' % (name, self.marks[name]))
+        if all(m in self.marks for m in self.milestones):
+            self.save()
+
+    def save(self):
+        new = not os.path.exists(self.path)
+        with open(self.path, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if new:
+                writer.writerow(['date'] + self.milestones)
+            writer.writerow([time.strftime('%Y-%m-%d %H:%M:%S')] +
+                            ['%.3f' % self.marks[m] if m in self.marks else '' for m in self.milestones])
+
+    def report(self):
+        return ', '.join('%s %.2f s' % (m, self.marks[m]) if m in self.marks else '%s -' % m
+                         for m in self.milestones)
+
+
+class BackgroundLoad:
+
+    def __init__(self, target):
+        self.target = target
+        self.error = None
+        self._ready = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self.target()
+        except Exception as e:
+            self.error = e
+            return
+        self._ready.set()
+
+    # True once target has returned; re-raises its exception if it failed
+    def ready(self):
+        if self.error is not None:
+            raise self.error
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        self._ready.wait(timeout)
+        return self.ready()
@@ -0,0 +1,202 @@
+"""
+thread_budget.py
+
+One place to decide which cores the controller, inference and GUI get.
+
+apply() limits torch's intra-op threads and OpenCV's thread pool to the
+inference cores and moves every thread of the process that hasn't pinned
+itself onto them. Each of our own threads calls pin(role) to move itself
+onto its cores (controlLoop gets a core of its own) and to register for the
+per-thread CPU report; threads pinned before apply() keep their cores.
+
+Thread affinity uses sched_setaffinity on Linux and SetThreadAffinityMask on
+Windows. On Linux a new thread inherits the affinity of the thread that
+starts it, so running apply() before the first inference also covers the
+pools torch and OpenCV start later. Windows gives new threads the process
+mask instead, and the process mask can't be narrowed because a thread can
+only be pinned inside it; there apply() has to run again once those pools
+exist (after a warm-up inference) to move them off the control core.
+Per-thread CPU time comes from psutil if installed, else /proc.
+"""
+
+# region: package imports
+import os
+import sys
+import time
+import threading
+
+#endregion
+
+# Windows API constants
+THREAD_SET_INFORMATION = 0x0020
+THREAD_QUERY_INFORMATION = 0x0040
+TH32CS_SNAPTHREAD = 0x00000004
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+class ThreadBudget:
+
+    # controlCores: number of cores reserved for controlLoop, taken from the
+    # end of the available list. guiCores: cores reserved for the GUI, 0 to
+    # share the inference cores. The remaining cores go to inference. The
+    # GPS ingest thread ('gps') shares the GUI cores.
+    def __init__(self, controlCores=1, guiCores=0, cores=None):
+        cores = list(cores) if cores is not None else available_cores()
+        if len(cores) <= controlCores + guiCores:
+            # not enough cores to partition: everyone shares everything
+            self.roles = {'control': cores, 'gui': cores, 'inference': cores, 'gps': cores}
+        else:
+            control = cores[len(cores) - controlCores:]
+            rest = cores[:len(cores) - controlCores]
+            gui = rest[len(rest) - guiCores:] if guiCores else rest
+            inference = rest[:len(rest) - guiCores] if guiCores else rest
+            self.roles = {'control': control, 'gui': gui, 'inference': inference, 'gps': gui}
+
+        self.threads = {}
+        self._lastSample = {}
+        # apply() may run on a background thread while others pin themselves
+        self._lock = threading.Lock()
+
+    # Configure torch/OpenCV thread pools and move every unpinned thread onto
+    # the inference cores
+    def apply(self):
+        inference = self.roles['inference']
+        try:
+            import torch
+            torch.set_num_threads(len(inference))
+        except ImportError:
+            pass
+        try:
+            import cv2
+            cv2.setNumThreads(len(inference))
+        except ImportError:
+            pass
+        with self._lock:
+            # threads already pinned keep their own cores
+            pinned = {tid: self.roles[role] for role, tid in self.threads.items()}
+            for tid in _task_ids():
+                _set_thread_affinity(pinned.get(tid, inference), tid)
+
+    # Move the calling thread onto the cores of role and register it
+    def pin(self, role):
+        with self._lock:
+            _set_thread_affinity(self.roles[role])
+            self.threads[role] = threading.get_native_id()
+        self._lastSample[role] = (time.time(), _thread_cpu_time(self.threads[role]))
+
+    # CPU use of each registered thread since the previous call, in percent
+    # of one core
+    def usage(self):
+        out = {}
+        for role, tid in self.threads.items():
+            now = time.time()
+            cpu = _thread_cpu_time(tid)
+            t0, cpu0 = self._lastSample.get(role, (now, cpu))
+            self._lastSample[role] = (now, cpu)
+            if cpu is None or cpu0 is None or now <= t0:
+                out[role] = None
+            else:
+                out[role] = 100.0 * (cpu - cpu0) / (now - t0)
+        return out
+
+    def report(self):
+        lines = []
+        usage = self.usage()
+        for role, cores in self.roles.items():
+            u = usage.get(role)
+            lines.append("%-9s cores %-12s cpu %s" % (
+                role, ','.join(str(c) for c in cores),
+                '-' if u is None else '%.0f%%' % u))
+        return '\n'.join(lines)
+
+
+# Pin a thread (the calling one by default)
+def _set_thread_affinity(cores, tid=None):
+    if hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0 if tid is None else tid, cores)
+        except OSError:
+            pass
+    elif sys.platform == 'win32':
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        if tid is None:
+            kernel32.SetThreadAffinityMask(kernel32.GetCurrentThread(), _mask(cores))
+            return
+        handle = kernel32.OpenThread(THREAD_SET_INFORMATION | THREAD_QUERY_INFORMATION, False, tid)
+        if handle:
+            kernel32.SetThreadAffinityMask(handle, _mask(cores))
+            kernel32.CloseHandle(handle)
+
+
+def _mask(cores):
+    mask = 0
+    for c in cores:
+        mask |= 1 << c
+    return mask
+
+
+# Native ids of every thread of the process
+def _task_ids():
+    if sys.platform == 'win32':
+        return _windows_thread_ids()
+    try:
+        return [int(t) for t in os.listdir('/proc/self/task')]
+    except OSError:
+        # no /proc: at least the calling thread
+        return [threading.get_native_id()]
+
+
+def _windows_thread_ids():
+    import ctypes
+    from ctypes import wintypes
+
+    class THREADENTRY32(ctypes.Structure):
+        _fields_ = [('dwSize', wintypes.DWORD), ('cntUsage', wintypes.DWORD),
+                    ('th32ThreadID', wintypes.DWORD), ('th32OwnerProcessID', wintypes.DWORD),
+                    ('tpBasePri', wintypes.LONG), ('tpDeltaPri', wintypes.LONG),
+                    ('dwFlags', wintypes.DWORD)]
+
+    kernel32 = ctypes.windll.kernel32
+    kernel32.CreateToolhelp32Snapshot.restype = wintypes.HANDLE
+    snapshot = kernel32.CreateToolhelp32Snapshot(TH32CS_SNAPTHREAD, 0)
+    if snapshot in (None, wintypes.HANDLE(-1).value):
+        return [threading.get_native_id()]
+    pid = os.getpid()
+    ids = []
+    entry = THREADENTRY32()
+    entry.dwSize = ctypes.sizeof(THREADENTRY32)
+    try:
+        ok = kernel32.Thread32First(snapshot, ctypes.byref(entry))
+        while ok:
+            if entry.th32OwnerProcessID == pid:
+                ids.append(entry.th32ThreadID)
+            ok = kernel32.Thread32Next(snapshot, ctypes.byref(entry))
+    finally:
+        kernel32.CloseHandle(wintypes.HANDLE(snapshot))
+    return ids
+
+
+# User + system CPU seconds of a thread, or None if it can't be read
+def _thread_cpu_time(tid):
+    try:
+        import psutil
+        for t in psutil.Process().threads():
+            if t.id == tid:
+                return t.user_time + t.system_time
+        return None
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/task/%d/stat' % tid) as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        ticks = os.sysconf('SC_CLK_TCK')
+        # utime and stime are fields 14 and 15 of stat; 12 and 13 after the comm
+        return (int(fields[11]) + int(fields[12])) / ticks
+    except (OSError, ValueError, IndexError):
+        return None
@@ -0,0 +1,148 @@
+"""
+vis_sink.py
+
+Visualisation off the inference hot path. The inference loop hands over a
+result (or a frame) per stream with submit(), which only stores a reference
+and returns. A worker thread renders the latest item of each stream at no
+more than maxFps and either encodes it into segmented MJPEG .avi files or
+keeps it for show(). HighGUI windows must be driven from one thread, so
+show() is called by the inference loop itself and only does the imshow and
+waitKey. Anything submitted while the worker is busy replaces the pending
+item and is counted as dropped, so the inference loop never waits for
+drawing.
+
+Videos are written at maxFps. The worker renders less often when fewer
+frames arrive, so each frame is repeated for as many frame periods as have
+passed since the previous one and the video plays back at real speed.
+
+Frames are referenced, not copied: if the camera reuses its buffer, a
+rendered image can show slightly newer pixels than its boxes.
+"""
+
+# region: package imports
+import re
+import time
+from threading import Thread, Condition
+
+import cv2
+
+#endregion
+
+
+class VisualisationSink:
+
+    # record: path prefix for video files, e.g. 'runs/lap' ->
+    # runs/lap_<stream>_000.avi; None opens windows instead.
+    # segmentSeconds: start a new file after this many seconds of video
+    def __init__(self, maxFps=10, record=None, segmentSeconds=60):
+        self.maxFps = maxFps
+        self.record = record
+        self.segmentSeconds = segmentSeconds
+
+        self.submitted = 0
+        self.rendered = 0
+        self.dropped = 0
+
+        self._pending = {}
+        self._rendered = {}
+        self._writers = {}
+        self._cond = Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        for writer, _, _, _ in self._writers.values():
+            writer.release()
+        self._writers = {}
+        if self.record is None:
+            cv2.destroyAllWindows()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # item is an ultralytics Results object (drawn with plot()) or a BGR frame
+    def submit(self, name, item):
+        with self._cond:
+            self.submitted += 1
+            if name in self._pending:
+                self.dropped += 1
+            self._pending[name] = item
+            self._cond.notify()
+
+    # Show the latest rendered image of each stream; call from the thread
+    # that owns the windows, e.g. once per inference loop iteration
+    def show(self):
+        if self.record is not None:
+            return
+        with self._cond:
+            rendered = self._rendered
+            self._rendered = {}
+        for name, image in rendered.items():
+            cv2.imshow(name, image)
+        cv2.waitKey(1)
+
+    def _run(self):
+        period = 1.0 / self.maxFps
+        while True:
+            with self._cond:
+                while self._running and not self._pending:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                pending = self._pending
+                self._pending = {}
+
+            t0 = time.time()
+            for name, item in pending.items():
+                image = item.plot() if hasattr(item, 'plot') else item
+                self._output(name, image)
+                self.rendered += 1
+
+            delay = period - (time.time() - t0)
+            if delay > 0:
+                time.sleep(delay)
+
+    def _output(self, name, image):
+        if self.record is None:
+            with self._cond:
+                self._rendered[name] = image
+            return
+        now = time.time()
+        writer, opened, segment, written = self._writer(name, image, now)
+        # frames due by now at maxFps, at least this one
+        repeat = max(1, int((now - opened) * self.maxFps) + 1 - written)
+        for _ in range(repeat):
+            writer.write(image)
+        self._writers[name] = (writer, opened, segment, written + repeat)
+
+    # Video writer for a stream as (writer, opened, segment, frames
+    # written), rolled over every segmentSeconds
+    def _writer(self, name, image, now):
+        entry = self._writers.get(name)
+        if entry is not None and now - entry[1] < self.segmentSeconds:
+            return entry
+        segment = -1
+        if entry is not None:
+            entry[0].release()
+            segment = entry[2]
+        segment += 1
+        path = '%s_%s_%03d.avi' % (self.record, re.sub(r'\W+', '_', name), segment)
+        height, width = image.shape[:2]
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'),
+                                 self.maxFps, (width, height))
+        self._writers[name] = (writer, now, segment, 0)
+        return self._writers[name]